@@ -1,11 +1,17 @@
 import os
 import dotenv
-from pydantic import BaseSettings  # A class for managing configuration or environment settings
+from typing import Optional
+from fastapi.security import OAuth2, SecurityScopes  # The scopes required by the route being called
+from starlette.requests import HTTPConnection
 from fastapi_azure_auth import SingleTenantAzureAuthorizationCodeBearer  # Used to handle OAuth2 authentication for single-tenant applications with AAD
-from Backend.app.utils.get_credentials import get_vault_secret
+from fastapi_azure_auth.exceptions import InvalidAuth
+from fastapi_azure_auth.user import User
+from Backend.app.utils.get_credentials import secret_provider
+from Backend.app.utils.token_cache import TokenCache
+from Backend.app.config.container import container
 
 
-class ADSettings(BaseSettings):
+class ADSettings():
     """
     Azure AD settings
 
@@ -14,25 +20,159 @@ class ADSettings(BaseSettings):
     """
     
     def __init__(self):
-        if os.path.exists(".env"):
+        self.from_vault = not os.path.exists(".env")
+        if not self.from_vault:
             dotenv.load_dotenv(".env")
-            self.tenant_id = os.getenv("AZ-TENANT-ID")
-            self.client_id = os.getenv("AZ-APP-CLIENT-ID")
+            self._tenant_id = os.getenv("AZ-TENANT-ID")
+            self._client_id = os.getenv("AZ-APP-CLIENT-ID")
         else:
-            self.tenant_id = get_vault_secret("AZ-TENANT-ID")
-            self.client_id = get_vault_secret("AZ-APP-CLIENT-ID")
-
-
-ad_settings = ADSettings()
-
-# Azure AD authentication scheme setup - used in the `Security` dependency in the API routes
-azure_scheme = SingleTenantAzureAuthorizationCodeBearer(
-    tenant_id=ad_settings.tenant_id,
-    app_client_id=ad_settings.client_id,
-    scopes={
-        # These are ALL the scopes required for accessing the API endpoints (set up in `Expose an API` in Enterprise App)
-        f"api://{ad_settings.client_id}/User.Read": "User.Read",
-        f"api://{ad_settings.client_id}/User.Write": "User.Write",
-        f"api://{ad_settings.client_id}/User.Delete": "User.Delete",
-    }
+            secret_provider.get_many(["AZ-TENANT-ID", "AZ-APP-CLIENT-ID"])  # Fetched in parallel - the properties below then read the cached values
+
+
+    # Read through the secret provider on every access, so they follow the Key Vault (the provider refreshes them in the background)
+    @property
+    def tenant_id(self) -> Optional[str]:
+        return secret_provider.get("AZ-TENANT-ID") if self.from_vault else self._tenant_id
+
+
+    @property
+    def client_id(self) -> Optional[str]:
+        return secret_provider.get("AZ-APP-CLIENT-ID") if self.from_vault else self._client_id
+
+
+class CachedSingleTenantAzureAuthorizationCodeBearer(SingleTenantAzureAuthorizationCodeBearer):
+    """
+        Azure AD authentication scheme which remembers verified tokens
+
+        Verifying a token (decoding it and checking its signature) is done once per token; later requests with the same token are served from `token_cache`.
+        The required scopes are still checked on every request, and the cache is emptied when Azure AD's signing keys change.
+    """
+
+    def __init__(self, *args, token_cache: TokenCache, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.token_cache = token_cache
+        self.signing_key_ids = frozenset()
+
+
+    async def __call__(self, request: HTTPConnection, security_scopes: SecurityScopes) -> Optional[User]:
+        access_token = await self.extract_access_token(request)
+        key = self.token_cache.key(access_token) if access_token else None
+
+        if key is not None:
+            await self.openid_config.load_config()  # Only fetches anything once the OpenID configuration is due for a refresh
+            self.check_signing_keys()
+            user = self.token_cache.get(key)
+            if user is not None:
+                if not self.has_scopes(user, security_scopes):
+                    return self.reject("Required scope missing", request)
+                request.state.user = user
+                return user
+
+        user = await super().__call__(request, SecurityScopes())  # Full verification - the scopes are checked below, so the cached user is valid for any route
+        if user is None:
+            return None
+
+        self.check_signing_keys()
+        self.token_cache.set(key, user, user.claims.get("exp"))
+        if not self.has_scopes(user, security_scopes):
+            return self.reject("Required scope missing", request)
+        return user
+
+
+    def check_signing_keys(self):
+        # A new set of signing keys (key rotation) means cached tokens may no longer be valid
+        key_ids = frozenset(getattr(self.openid_config, "signing_keys", {}))
+        if key_ids != self.signing_key_ids:
+            if self.signing_key_ids:
+                self.token_cache.clear()
+            self.signing_key_ids = key_ids
+
+
+    @staticmethod
+    def has_scopes(user: User, security_scopes: SecurityScopes) -> bool:
+        token_scopes = user.claims.get("scp", "")
+        if not isinstance(token_scopes, str):
+            return False
+        return set(security_scopes.scopes).issubset(token_scopes.split(" "))
+
+
+    def reject(self, detail: str, request: HTTPConnection):
+        if not self.auto_error:
+            return None
+        raise InvalidAuth(detail=detail, request=request)
+
+
+class LazyAzureScheme(OAuth2):
+    """
+        Stand-in for the authentication scheme in the `Security` dependencies of the routes
+
+        The routes are declared when their modules are imported, but the real scheme needs the tenant and client IDs (secrets),
+        so it is only created - by the container - when the first request (or the OpenAPI docs) needs it.
+        Being an `OAuth2` instance makes FastAPI list it, with the scopes of each route, in the OpenAPI schema.
+    """
+
+    def __init__(self, service: str = "azure_scheme"):
+        # `OAuth2.__init__` is not called: `model` and `scheme_name` come from the real scheme
+        self.service = service
+
+
+    @property
+    def scheme(self) -> CachedSingleTenantAzureAuthorizationCodeBearer:
+        return container.get(self.service)
+
+
+    @property
+    def model(self):
+        return self.scheme.model
+
+
+    @property
+    def scheme_name(self) -> str:
+        return self.scheme.scheme_name
+
+
+    async def __call__(self, request: HTTPConnection, security_scopes: SecurityScopes) -> Optional[User]:
+        return await self.scheme(request, security_scopes)
+
+
+    def __getattr__(self, name: str):
+        # Anything else (e.g. `openid_config`) is read from the real scheme
+        if name == "service" or name.startswith("_"):
+            raise AttributeError(name)  # Not delegated, so copying or inspecting the stand-in (e.g. `inspect.signature`) never creates the scheme
+        return getattr(self.scheme, name)
+
+
+def build_azure_scheme() -> CachedSingleTenantAzureAuthorizationCodeBearer:
+    ad_settings = container.get("ad_settings")
+    return CachedSingleTenantAzureAuthorizationCodeBearer(
+        token_cache=token_cache,
+        tenant_id=ad_settings.tenant_id,
+        app_client_id=ad_settings.client_id,
+        scopes={
+            # These are ALL the scopes required for accessing the API endpoints (set up in `Expose an API` in Enterprise App)
+            f"api://{ad_settings.client_id}/User.Read": "User.Read",
+            f"api://{ad_settings.client_id}/User.Write": "User.Write",
+            f"api://{ad_settings.client_id}/User.Delete": "User.Delete",
+            f"api://{ad_settings.client_id}/Status.Read": "Status.Read",  # The service diagnostics under /api/status
+        }
+    )
+
+
+# Cache of verified tokens (size and lifetime limits can be set in the environment)
+token_cache = TokenCache(
+    max_size=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+    max_ttl=float(os.getenv("AUTH_CACHE_MAX_TTL", "3600")),
 )
+
+# The settings and the scheme are created on first use (reading the settings fetches secrets)
+container.register("ad_settings", ADSettings)
+container.register("azure_scheme", build_azure_scheme)
+
+# Azure AD authentication scheme - used in the `Security` dependency in the API routes
+azure_scheme = LazyAzureScheme()
+
+
+def __getattr__(name: str):
+    if name == "ad_settings":
+        return container.get("ad_settings")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
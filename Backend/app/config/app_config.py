@@ -1,36 +1,106 @@
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware  # CORS (Cross-Origin Resource Sharing) is a mechanism that allows resources (e.g. APIs) on a web page to be requested from other domains
 from Backend.app.routes import router as api_router
+from Backend.app.routes.metrics import router as metrics_router
+from Backend.app.utils.metrics import MetricsMiddleware
+from Backend.app.config.db_routing import ReadYourWritesMiddleware
+from Backend.app.config.ad_config import azure_scheme
+from Backend.app.config.container import container
+from Backend.app.utils.logger import handler, get_logger
+from Backend.app.utils.get_credentials import secret_provider
+from Backend.app.utils.user_stats import refresh_user_stats, keep_user_stats_current
+from Backend.app.utils.write_behind import user_write_behind
 
+logger = get_logger(__name__)
 
-app = FastAPI(title="App name", description="App description", version="0.0.1")
 
-# Set CORS-allowed origins: these are the URLs that are permitted to make requests to the application. These are the domains or URLs from which the frontend may be hosted.
-origins = ["http://localhost:5173", "https://localhost:5173"]
+# Services created by the lifespan hook, before the first request (the rest are created when first used).
+# Set STARTUP_SERVICES="" to create everything on first use instead.
+DEFAULT_STARTUP_SERVICES = "db_engine,db_session,db_async_engine,db_async_session,db_executor,azure_scheme"
+# Serve /metrics - off by default, as it is not behind Azure AD (Prometheus cannot get a token): turn it on where only the scraper can reach the app,
+# e.g. on an internal network or behind a proxy which blocks the path from outside
+METRICS_ENDPOINT = os.getenv("METRICS_ENDPOINT", "false").lower() == "true"
+USER_STATS = os.getenv("USER_STATS", "true").lower() == "true"  # Build the age histogram of /api/users/stats at startup and keep it current
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,  # This allows requests from the specified origins to access the application's endpoints
-    allow_credentials=True, # Enables support for sending credentials (e.g. cookies)
-    allow_methods=["*"],    # Specifies the HTTP methods (e.g. GET, POST, PUT, DELETE) that are allowed in CORS requests - ["*"] allows all methods
-    allow_headers=["*"],    # Specifies the HTTP headers that are allowed in CORS requests - ["*"] allows all headers
-    # Headers/Responses in HTTP requests provide additional information about the request/response being sent/received
-)
 
-# The base router for the API. The URL for the endpoints will be of the form /api/...,
-app.include_router(api_router, prefix="/api")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: runs in each worker process once it has started - nothing here happens when the app is only imported
+    handler.listener.start()  # The log listener (the thread which writes out the queued log records)
 
-# Startup and shutdown the GHDServerHandler listener to send logs to the server
-@app.on_event("startup")
-async def server_start():  # Asynchronous function: allows other parts of the program to continue executing while the task is in progress
-    handler.listener.start()
-    await azure_scheme.openid_config.load_config()  # "await" pauses the function's execution and allows other tasks to run until this is finished
+    services = [name.strip() for name in os.getenv("STARTUP_SERVICES", DEFAULT_STARTUP_SERVICES).split(",") if name.strip()]
+    await asyncio.to_thread(container.warm, services)  # Reading secrets and creating engines blocks, so it is done on a thread
 
+    if container.is_built("azure_scheme"):
+        start = time.perf_counter()
+        await azure_scheme.openid_config.load_config()  # "await" pauses the function's execution and allows other tasks to run until this is finished
+        container.record("openid_config", time.perf_counter() - start)
 
-@app.on_event("shutdown")
-async def server_start():
-    handler.listener.stop()
-    pass
+    stats_task = None
+    if USER_STATS:
+        start = time.perf_counter()
+        try:
+            await refresh_user_stats()  # One GROUP BY query; the writes keep the histogram current from here on
+        except Exception as e:
+            logger.warning(f"User stats not loaded at startup, retrying in the background: {e}")
+        container.record("user_stats", time.perf_counter() - start)
+        stats_task = asyncio.create_task(keep_user_stats_current())  # Periodic recounts (and the retry, if the load failed)
 
+    report = container.report()
+    logger.info(f"Startup took {report['total_seconds']:.3f}s: {report['built_seconds']}")
 
+    yield  # The app serves requests here
+
+    # Shutdown
+    if stats_task is not None:
+        stats_task.cancel()
+    await user_write_behind.close()  # Writes out the queued user changes while the database is still available
+    await container.aclose()  # Disposes of the connection pools
+    secret_provider.stop_refresh()
+    handler.listener.stop()  # Writes out the remaining records before stopping
+
+
+def create_app() -> FastAPI:
+    """
+        Creating the FastAPI application
+
+        Only the routes and middleware are set up here; the database and authentication are created by the lifespan hook or on first use,
+        so this takes milliseconds and does no I/O. Also usable with `uvicorn --factory Backend.app.config.app_config:create_app`.
+    """
+
+    start = time.perf_counter()
+    app = FastAPI(title="App name", description="App description", version="0.0.1", lifespan=lifespan)
+
+    # Set CORS-allowed origins: these are the URLs that are permitted to make requests to the application. These are the domains or URLs from which the frontend may be hosted.
+    origins = ["http://localhost:5173", "https://localhost:5173"]
+
+    # Add CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,  # This allows requests from the specified origins to access the application's endpoints
+        allow_credentials=True, # Enables support for sending credentials (e.g. cookies)
+        allow_methods=["*"],    # Specifies the HTTP methods (e.g. GET, POST, PUT, DELETE) that are allowed in CORS requests - ["*"] allows all methods
+        allow_headers=["*"],    # Specifies the HTTP headers that are allowed in CORS requests - ["*"] allows all headers
+        # Headers/Responses in HTTP requests provide additional information about the request/response being sent/received
+    )
+
+    # Records the latency, status code and database query count of every request (served at /metrics with METRICS_ENDPOINT=true)
+    app.add_middleware(MetricsMiddleware)
+
+    # Once a request has written to the primary database, its later reads go there too instead of to a read replica which may lag behind
+    app.add_middleware(ReadYourWritesMiddleware)
+
+    # The base router for the API. The URL for the endpoints will be of the form /api/...,
+    app.include_router(api_router, prefix="/api")
+    if METRICS_ENDPOINT:
+        app.include_router(metrics_router)  # At the root (/metrics), where Prometheus looks by default
+
+    container.record("create_app", time.perf_counter() - start)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,140 @@
+import os
+import time
+import inspect
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+class ServiceContainer():
+    """
+        The app's shared services (engines, session factories, auth scheme, ...), each created the first time it is needed
+
+        Modules register a factory per service at import time, which costs nothing; the work (reading secrets, creating engines)
+        happens on the first `get`, or in the app's lifespan hook (`warm`). How long each service took to build is kept for the startup report.
+    """
+
+    def __init__(self):
+        self.factories: Dict[str, Callable[[], Any]] = {}
+        self.closers: Dict[str, Callable[[Any], Any]] = {}
+        self.fork_handlers: Dict[str, Callable[[Any], Any]] = {}
+        self.instances: Dict[str, Any] = {}
+        self.timings: Dict[str, float] = {}  # name -> seconds spent building it, not counting the services it needed
+        self.lock = threading.RLock()  # Re-entrant, as a factory usually gets the services it depends on
+        self.building = threading.local()  # Stack of the services being built by this thread (for the timings)
+
+
+    def register(self, name: str, factory: Callable[[], Any], close: Optional[Callable[[Any], Any]] = None, after_fork: Optional[Callable[[Any], Any]] = None):
+        """
+            Adding a service - `close` (sync or async) is called with the instance when the app shuts down,
+            `after_fork` with the inherited instance in a forked worker process (see `reset_after_fork`)
+        """
+
+        with self.lock:
+            self.factories[name] = factory
+            if close is not None:
+                self.closers[name] = close
+            if after_fork is not None:
+                self.fork_handlers[name] = after_fork
+
+
+    def get(self, name: str) -> Any:
+        if name in self.instances:
+            return self.instances[name]
+
+        with self.lock:
+            if name in self.instances:  # Built by another thread while this one waited for the lock
+                return self.instances[name]
+            if name not in self.factories:
+                raise KeyError(f"No service registered as '{name}'")
+
+            stack = self.building.__dict__.setdefault("stack", [])
+            stack.append(0.0)  # Time spent on the services this one depends on
+            start = time.perf_counter()
+            try:
+                instance = self.factories[name]()
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+
+            self.instances[name] = instance
+            self.timings[name] = elapsed - nested
+            return instance
+
+
+    def peek(self, name: str) -> Any:
+        """
+            The service if it has been built, otherwise None (without building it)
+        """
+
+        return self.instances.get(name)
+
+
+    def is_built(self, name: str) -> bool:
+        return name in self.instances
+
+
+    def warm(self, names: Iterable[str]):
+        for name in names:
+            self.get(name)
+
+
+    def record(self, name: str, seconds: float):
+        """
+            Adding a startup step which is not a service (e.g. loading the OpenID configuration) to the report
+        """
+
+        with self.lock:
+            self.timings[name] = seconds
+
+
+    def report(self) -> dict:
+        with self.lock:
+            timings = dict(self.timings)
+            pending = [name for name in self.factories if name not in self.instances]
+        return {
+            "built_seconds": {name: round(seconds, 6) for name, seconds in timings.items()},
+            "total_seconds": round(sum(timings.values()), 6),
+            "not_built": pending,
+        }
+
+
+    async def aclose(self):
+        """
+            Closing the built services, the most recently built first
+        """
+
+        with self.lock:
+            built = [(name, self.instances.pop(name)) for name in reversed(list(self.instances))]
+        for name, instance in built:
+            close = self.closers.get(name)
+            if close is None or instance is None:
+                continue
+            result = close(instance)
+            if inspect.isawaitable(result):
+                await result
+
+
+    def reset_after_fork(self):
+        """
+            Forgetting the services inherited from the parent process, so that each forked worker builds its own
+
+            Runs in the child right after a fork (e.g. gunicorn workers with `preload`). Connections and threads cannot be shared
+            between processes: `after_fork` lets a service let go of them without closing them, as they still belong to the parent
+            (an engine's pool is dropped with `dispose(close=False)`).
+        """
+
+        self.lock = threading.RLock()  # The parent's lock may have been held by one of its other threads, which do not exist here
+        self.building = threading.local()
+        inherited, self.instances = self.instances, {}
+        for name, instance in inherited.items():
+            handler = self.fork_handlers.get(name)
+            if handler is not None and instance is not None:
+                handler(instance)
+
+
+container = ServiceContainer()
+
+if hasattr(os, "register_at_fork"):  # Not on Windows, where processes are never forked
+    os.register_at_fork(after_in_child=container.reset_after_fork)
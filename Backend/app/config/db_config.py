@@ -1,25 +1,134 @@
 import os
+import time
 import dotenv
-from Backend.app.utils.logger import logger
-from Backend.app.utils.get_credentials import get_vault_secret
-from sqlalchemy.engine import URL  # The URL for connecting to the database
-from sqlalchemy import Engine, create_engine  # An Engine is the starting point of the SQLAlchemy application - it manages a pool of database connections and provides a high-level interface for executing SQL commands
+import asyncio
+import threading
+import functools
+import contextvars  # Context variables hold per-request state (e.g. request ID) that has to follow the request into worker threads
+from typing import List, Optional
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor  # A fixed-size pool of worker threads - used to run blocking database calls outside the event loop
+from Backend.app.utils.logger import get_logger
+from Backend.app.utils.metrics import install_db_metrics
+from Backend.app.utils.get_credentials import secret_provider
+from Backend.app.config.container import container
+from Backend.app.config.db_routing import Replica, ReplicaSet, RoutingSession
+from sqlalchemy.engine import URL, make_url  # The URL for connecting to the database
+from sqlalchemy import Engine, create_engine, event  # An Engine is the starting point of the SQLAlchemy application - it manages a pool of database connections and provides a high-level interface for executing SQL commands
+from sqlalchemy.pool import Pool, QueuePool, AsyncAdaptedQueuePool  # A pool keeps database connections open between uses, so each query does not pay for a new login
 from sqlalchemy.orm import Session, sessionmaker # A Session is an instance of database interaction - each session object manages its own database connection
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine  # The asyncio versions of the above - queries are awaited instead of blocking the event loop
+
+logger = get_logger(__name__)
+
+
+# The asyncio driver to use for each synchronous driver
+ASYNC_DRIVERS = {
+    "mssql+pyodbc": "mssql+aioodbc",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+SYNC_DRIVERS = {"mssql+aioodbc": "mssql+pyodbc", "sqlite+aiosqlite": "sqlite"}
+
+
+class PoolWaitStats():
+    """
+        Running totals of how long checkouts waited for a connection from a pool
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_seconds_total": round(self.total_wait, 6),
+                "wait_seconds_avg": round(self.total_wait / self.checkouts, 6) if self.checkouts else 0.0,
+                "wait_seconds_max": round(self.max_wait, 6),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """
+        A QueuePool which records the time spent waiting for each connection (including opening new ones)
+    """
+
+    # SQLAlchemy names a pool's logger after its class - keeping QueuePool's name leaves it under the "sqlalchemy" logger (WARNING),
+    # rather than under this module's, which inherits LOG_LEVEL and would log every checkout and return
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.QueuePool"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_stats.record(time.perf_counter() - start)
+
+
+class TimedAsyncAdaptedQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """
+        The asyncio version of `TimedQueuePool` (used by the asyncio engine)
+    """
+
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.AsyncAdaptedQueuePool"
 
 
 class DBConfig():
     def __init__(self):
-        if os.path.exists(".env"):  # Local development
-            dotenv.load_dotenv(".env")  
+        self.password_from_vault = not os.path.exists(".env")  # Read again through `secret_provider` for each new connection (see `use_current_password`)
+        if not self.password_from_vault:  # Local development
+            dotenv.load_dotenv(".env")
             self.server = os.getenv("server")
             self.database = os.getenv("database") 
             self.username = os.getenv("username")
             self.password = os.getenv("password")
         else:  # Production
-            self.server = get_vault_secret("DB-SERVER")
-            self.database =  get_vault_secret("DB-NAME")
-            self.username =  get_vault_secret("DB-USERNAME")
-            self.password = get_vault_secret("DB-PASSWORD")
+            secrets = secret_provider.get_many(["DB-SERVER", "DB-NAME", "DB-USERNAME", "DB-PASSWORD"])  # Fetched in parallel
+            self.server = secrets["DB-SERVER"]
+            self.database = secrets["DB-NAME"]
+            self.username = secrets["DB-USERNAME"]
+            self.password = secrets["DB-PASSWORD"]
+
+        self.url = os.getenv("DB_URL")  # Optional full URL (e.g. "sqlite:///./users.db") which replaces the server settings above - used to test against a local database
+        self.mode = os.getenv("DB_MODE", "async").lower()  # "async": queries go through an asyncio driver, "sync": the blocking driver runs in a thread pool
+        self.thread_pool_size = int(os.getenv("DB_THREAD_POOL_SIZE", "10"))  # Maximum number of blocking queries running at once in "sync" mode
+
+        # Connection pool settings (shared by the SQLAlchemy engines and the pyODBC pool)
+        self.pool_size = int(os.getenv("DB_POOL_SIZE", "5"))  # Connections kept open
+        self.max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # Extra connections opened under load (closed again when returned)
+        self.pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Seconds after which a connection is replaced (before the server or a firewall drops it)
+        self.pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # Test each connection when it is checked out and reconnect if it is dead
+        self.pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Seconds to wait for a free connection before giving up
+
+        # Read replicas - full URLs (e.g. "sqlite:///./replica1.db,sqlite:///./replica2.db") and/or server names which share the
+        # primary's database and credentials. Without any, everything goes to the primary as before
+        self.replica_urls = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+        self.replica_servers = [server.strip() for server in os.getenv("DB_REPLICA_SERVERS", "").split(",") if server.strip()]
+        self.replica_strategy = os.getenv("DB_REPLICA_STRATEGY", "round_robin").lower()  # "round_robin" or "least_latency" (fastest recent ping)
+        self.replica_check_interval = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "10"))  # Seconds between health pings, 0 to disable them
+        self.replica_max_failures = int(os.getenv("DB_REPLICA_MAX_FAILURES", "3"))  # Failed pings in a row before a replica is taken out of rotation
+        self.read_your_writes = os.getenv("DB_READ_YOUR_WRITES", "true").lower() == "true"  # After a request writes, its later reads go to the primary
+
+        self._engine = None
+        self._async_engine = None
+        self._raw_pool = None
 
 
     def get_url(self) -> URL:
@@ -27,6 +136,9 @@ class DBConfig():
             Creating the database URL
         """
         
+        if self.url:
+            return make_url(self.url)
+
         CONNECTION_URL = URL.create(
             "mssql+pyodbc",
             host=self.server,
@@ -38,13 +150,134 @@ class DBConfig():
         
         return CONNECTION_URL
     
+
+    def current_password(self) -> Optional[str]:
+        # Cached by the provider and refreshed in the background before it expires, so this is a dictionary lookup
+        return secret_provider.get("DB-PASSWORD") if self.password_from_vault else self.password
+
+
+    def use_current_password(self, engine: Engine):
+        """
+            Connecting `engine` with the current DB-PASSWORD rather than the one in its URL
+
+            The password is read through the secret provider each time the pool opens a connection, so a rotated password is used
+            by the next new connection without a restart (open ones keep working until `pool_recycle` replaces them).
+            Only applies to engines whose URL was built with the Key Vault credentials - not to a full `DB_URL` / `DB_REPLICA_URLS`.
+        """
+
+        url = engine.url
+        if not self.password_from_vault or url.password is None or url.password != self.password:
+            return
+
+        @event.listens_for(engine, "do_connect")
+        def set_current_password(dialect, connection_record, cargs, cparams):
+            # The connect arguments are rebuilt from the URL, as some drivers take the password in a connection string (pyODBC)
+            args, params = dialect.create_connect_args(url.set(password=self.current_password()))
+            cargs[:] = args
+            cparams.update(params)
+
+
+    def get_replica_urls(self) -> List[URL]:
+        """
+            Creating the URLs of the read replicas
+        """
+
+        urls = [make_url(url) for url in self.replica_urls]
+        if self.replica_servers:
+            primary = self.get_url()
+            urls += [primary.set(host=server) for server in self.replica_servers]
+        return [url.set(drivername=SYNC_DRIVERS.get(url.drivername, url.drivername)) for url in urls]
+
+
+    def get_async_url(self) -> URL:
+        """
+            Creating the database URL for the asyncio driver
+        """
+
+        url = self.get_url()
+        return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+    
     
+    def get_pool_options(self, pool_class=TimedQueuePool) -> dict:
+        """
+            Creating the connection pool arguments for `create_engine`
+        """
+
+        url = self.get_url()
+        if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+            return {}  # An in-memory SQLite database lives inside its one connection, so SQLAlchemy's default pool for it is kept
+
+        return {
+            "poolclass": pool_class,
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_recycle": self.pool_recycle,
+            "pool_pre_ping": self.pool_pre_ping,
+            "pool_timeout": self.pool_timeout,
+        }
+
+
     def get_engine(self) -> Engine:
         """
-            Creating the database engine
+            Creating the database engine (once - later calls return the same engine and so the same connection pool)
+        """
+
+        if self._engine is None:
+            url = self.get_url()
+            options = self.get_pool_options()
+            if url.drivername == "mssql+pyodbc":
+                options["fast_executemany"] = True  # pyODBC sends all the parameter sets of an executemany (bulk insert/update) in one round trip
+
+            self._engine = create_engine(url, **options)
+            self.use_current_password(self._engine)
+
+        return self._engine
+
+
+    def get_async_engine(self) -> AsyncEngine:
+        """
+            Creating the asyncio database engine (once)
+        """
+
+        if self._async_engine is None:
+            self._async_engine = create_async_engine(self.get_async_url(), **self.get_pool_options(TimedAsyncAdaptedQueuePool))
+            self.use_current_password(self._async_engine.sync_engine)  # Events of an asyncio engine are registered on its synchronous core
+
+        return self._async_engine
+
+
+    def get_raw_pool(self) -> Pool:
         """
+            Creating the pool of plain DBAPI (pyODBC) connections (once)
 
-        return create_engine(self.get_url())
+            `pool.connect()` returns a connection which goes back to the pool when closed.
+        """
+
+        if self._raw_pool is None:
+            engine = self.get_engine()
+            url = self.get_url()
+
+            def create_connection():
+                if url.drivername == "mssql+pyodbc":
+                    import pyodbc
+                    return pyodbc.connect(self.get_connection_string())
+                # Any other database (e.g. a local SQLite stand-in) is opened through the engine's driver
+                args, kwargs = engine.dialect.create_connect_args(url)
+                return engine.dialect.loaded_dbapi.connect(*args, **kwargs)
+
+            options = self.get_pool_options()
+            options.pop("poolclass", None)
+            self._raw_pool = TimedQueuePool(
+                create_connection,
+                pool_size=options.get("pool_size", 1),
+                max_overflow=options.get("max_overflow", 0),
+                recycle=options.get("pool_recycle", -1),
+                pre_ping=options.get("pool_pre_ping", False),
+                timeout=options.get("pool_timeout", 30),
+                dialect=engine.dialect,  # Needed for `pre_ping` (it runs the dialect's ping query)
+            )
+
+        return self._raw_pool
 
 
     def get_session(self) -> Session:
@@ -61,10 +294,226 @@ class DBConfig():
     
     # Used for pyODBC
     def get_connection_string(self) -> str:
-        return f"DRIVER={{SQL Server}};SERVER={self.server};DATABASE={self.database};UID={self.username};PWD={self.password}"
+        return f"DRIVER={{SQL Server}};SERVER={self.server};DATABASE={self.database};UID={self.username};PWD={self.current_password()}"
+
+
+class ThreadedSession():
+    """
+        Asyncio wrapper around a synchronous Session ("sync" mode)
+
+        Every call is run on `db_executor` so the blocking driver never holds up the event loop.
+        It exposes the part of the `AsyncSession` interface used by the routes, so they work the same in both modes.
+    """
+
+    def __init__(self, session: Session, executor: ThreadPoolExecutor):
+        self.sync_session = session
+        self.executor = executor
+
+
+    async def run_sync(self, fn, *args, **kwargs):
+        """
+            Running `fn(session, *args, **kwargs)` on a worker thread
+        """
+
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()  # `run_in_executor` does not carry context variables over by itself
+        call = functools.partial(context.run, fn, self.sync_session, *args, **kwargs)
+        return await loop.run_in_executor(self.executor, call)
+
+
+    async def execute(self, statement, params=None, **kwargs):
+        # The rows are fetched on the worker thread (`freeze`), so reading the result afterwards does no I/O
+        frozen = await self.run_sync(lambda session: session.execute(statement, params, **kwargs).freeze())
+        return frozen()
+
+
+    async def stream(self, statement, params=None, **kwargs):
+        """
+            Executing a statement without buffering its rows - use with the `yield_per` execution option
+        """
+
+        result = await self.run_sync(lambda session: session.execute(statement, params, **kwargs))
+        return ThreadedResult(result, self)
+
+
+    async def commit(self):
+        await self.run_sync(Session.commit)
+
+
+    async def rollback(self):
+        await self.run_sync(Session.rollback)
+
+
+    async def close(self):
+        await self.run_sync(Session.close)
+
+
+class ThreadedResult():
+    """
+        Asyncio wrapper around an unbuffered Result ("sync" mode)
+
+        Each batch of rows is fetched on a worker thread, like `AsyncResult.partitions`.
+    """
+
+    def __init__(self, result, session: ThreadedSession):
+        self.result = result
+        self.session = session
+
+
+    async def partitions(self, size=None):
+        partitions = self.result.partitions(size)
+        while True:
+            rows = await self.session.run_sync(lambda _: next(partitions, None))
+            if not rows:
+                break
+            yield rows
+
+
+def build_async_engine() -> Optional[AsyncEngine]:
+    # Only created in "async" mode, so the asyncio driver is not needed otherwise
+    config = container.get("db_config")
+    if config.mode != "async":
+        return None
+    engine = config.get_async_engine()
+    install_db_metrics(engine.sync_engine)  # Events of an asyncio engine are registered on its synchronous core
+    return engine
+
+
+def build_engine() -> Engine:
+    engine = container.get("db_config").get_engine()
+    install_db_metrics(engine)  # Statement timing for the /metrics endpoint and the slow query log
+    return engine
+
+
+def build_replicas() -> Optional[ReplicaSet]:
+    """
+        Creating the engines of the read replicas (None without replicas) and starting their health checks
+    """
+
+    config = container.get("db_config")
+    urls = config.get_replica_urls()
+    if not urls:
+        return None
+
+    replicas = []
+    for url in urls:
+        options = config.get_pool_options()
+        engine = create_engine(url, **options)
+        config.use_current_password(engine)  # Replicas given by server name share the primary's credentials
+        install_db_metrics(engine)
+        async_engine = None
+        if config.mode == "async":
+            async_engine = create_async_engine(url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername)), **config.get_pool_options(TimedAsyncAdaptedQueuePool))
+            config.use_current_password(async_engine.sync_engine)
+            install_db_metrics(async_engine.sync_engine)
+        replicas.append(Replica(url.render_as_string(hide_password=True), engine, async_engine))
+
+    replica_set = ReplicaSet(replicas, strategy=config.replica_strategy, max_failures=config.replica_max_failures, check_interval=config.replica_check_interval)
+    replica_set.start()
+    logger.info(f"{len(replicas)} read replica(s), {config.replica_strategy}")
+    return replica_set
+
+
+def build_session() -> sessionmaker:
+    # `RoutingSession` sends reads to the replicas (if any) and writes to the engine it is bound to (the primary)
+    config = container.get("db_config")
+    return sessionmaker(autocommit=False, autoflush=True, bind=container.get("db_engine"), class_=RoutingSession,
+                        replicas=container.get("db_replicas"), read_your_writes=config.read_your_writes)
+
+
+def build_async_session() -> Optional[async_sessionmaker]:
+    engine = container.get("db_async_engine")
+    if engine is None:
+        return None
+    # `expire_on_commit=False` keeps the loaded attributes usable after a commit (reloading them would need another `await`)
+    return async_sessionmaker(bind=engine, autoflush=True, expire_on_commit=False, sync_session_class=RoutingSession,
+                              replicas=container.get("db_replicas"), use_async_engines=True, read_your_writes=container.get("db_config").read_your_writes)
+
+
+# Nothing below connects to anything or reads a secret when this module is imported - each service is created on first use
+# (or by the app's lifespan hook), see `container.py`
+container.register("db_config", DBConfig)
+# `dispose(close=False)` after a fork: the child starts with an empty pool and leaves the inherited connections to the parent
+container.register("db_engine", build_engine, close=lambda engine: engine.dispose(), after_fork=lambda engine: engine.dispose(close=False))
+container.register("db_replicas", build_replicas, close=lambda replicas: replicas.close(), after_fork=lambda replicas: replicas.forget())
+container.register("db_session", build_session)
+container.register("db_connection_string", lambda: container.get("db_config").get_connection_string())  # For pyODBC
+container.register("db_raw_pool", lambda: container.get("db_config").get_raw_pool(), close=lambda pool: pool.dispose())  # Pooled pyODBC connections - nothing is opened until the first `connect()`
+container.register("db_async_engine", build_async_engine, close=lambda engine: engine.dispose(), after_fork=lambda engine: engine.sync_engine.dispose(close=False))
+container.register("db_async_session", build_async_session)
+container.register(
+    "db_executor",
+    lambda: ThreadPoolExecutor(max_workers=container.get("db_config").thread_pool_size, thread_name_prefix="db"),  # Threads are only started when first needed
+    close=lambda executor: executor.shutdown(wait=False),
+)
+
+
+DB_SERVICES = ("db_config", "db_engine", "db_replicas", "db_session", "db_connection_string", "db_raw_pool", "db_async_engine", "db_async_session", "db_executor")
+
+
+def __getattr__(name: str):
+    # The module-level names of the services (`from Backend.app.config.db_config import db_engine` still works, and creates the engine at that point)
+    if name in DB_SERVICES:
+        return container.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@asynccontextmanager
+async def open_session():
+    """
+        Opening a database session from async code
+
+        Yields an `AsyncSession` in "async" mode and a `ThreadedSession` in "sync" mode.
+    """
+
+    async_session = container.get("db_async_session")
+    if async_session is not None:
+        async with async_session() as session:
+            yield session
+    else:
+        session = ThreadedSession(container.get("db_session")(), container.get("db_executor"))
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+def describe_pool(pool: Pool) -> dict:
+    """
+        Reading the current usage of a connection pool
+    """
+
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),  # Negative while the pool has not opened all of its `pool_size` connections yet
+            "max_overflow": pool._max_overflow,
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.wait_stats.snapshot())
+
+    return stats
+
+
+def get_pool_stats() -> dict:
+    """
+        Reading the usage of the connection pools which have been created
+    """
+
+    stats = {}
+    for key, name in (("engine", "db_engine"), ("raw", "db_raw_pool"), ("async_engine", "db_async_engine")):
+        service = container.peek(name)  # Not created just to be reported on
+        if service is not None:
+            stats[key] = describe_pool(getattr(service, "pool", service))
 
+    replicas = container.peek("db_replicas")
+    if replicas is not None:
+        for replica in replicas.replicas:
+            stats[f"replica:{replica.name}"] = describe_pool(replica.engine.pool)
+            if replica.async_engine is not None:
+                stats[f"replica_async:{replica.name}"] = describe_pool(replica.async_engine.pool)
 
-db_config = DBConfig()
-db_engine = db_config.get_engine()
-db_session = sessionmaker(autocommit=False, autoflush=True, bind=db_engine)
-db_connection_string = db_config.get_connection_string()  # For pyODBC
\ No newline at end of file
+    return stats
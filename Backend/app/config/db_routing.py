@@ -0,0 +1,237 @@
+import time
+import itertools
+import threading
+import contextvars
+from typing import List, Optional
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncEngine
+from Backend.app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+PRIMARY = "use_primary"  # `session.info` key - set on sessions which must not read from a replica (e.g. because they write)
+STRATEGIES = ("round_robin", "least_latency")
+
+
+class ReadYourWrites():
+    """
+        Whether the current request has written to the primary (after which its reads go to the primary too)
+    """
+
+    def __init__(self):
+        self.pinned = False
+
+
+# The state of the request being handled - an object rather than a flag, so a write made in a worker thread or a copied context
+# (the "sync" mode runs queries in one) is seen by the rest of the request
+request_pin: contextvars.ContextVar[Optional[ReadYourWrites]] = contextvars.ContextVar("request_pin", default=None)
+
+
+def use_primary(session: Session):
+    """
+        Sending every later statement of `session` to the primary - called before a write, so the rows it reads first
+        (e.g. the user an UPDATE is about to change) come from the same database as the write
+    """
+
+    session.info[PRIMARY] = True
+
+
+class ReadYourWritesMiddleware():
+    """
+        ASGI middleware giving every request its own read-your-writes state
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = request_pin.set(ReadYourWrites())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_pin.reset(token)
+
+
+class Replica():
+    """
+        One read replica: its engines and health
+    """
+
+    def __init__(self, name: str, engine: Engine, async_engine: Optional[AsyncEngine] = None):
+        self.name = name
+        self.engine = engine  # Used for the health pings, and for the queries in "sync" mode
+        self.async_engine = async_engine  # Used for the queries in "async" mode
+        self.healthy = True
+        self.failures = 0  # Failed pings in a row
+        self.latency: Optional[float] = None  # Moving average of the ping time, in seconds
+        self.last_error: Optional[str] = None
+
+
+    def query_engine(self, asynchronous: bool) -> Engine:
+        # An AsyncSession runs its statements on the synchronous core of the asyncio engine
+        return self.async_engine.sync_engine if asynchronous else self.engine
+
+
+class ReplicaSet():
+    """
+        The read replicas and the choice between them
+
+        A background thread pings every replica each `check_interval` seconds. A replica failing `max_failures` pings in a row
+        is taken out of rotation until a ping succeeds again; with no healthy replica left, reads go to the primary.
+    """
+
+    def __init__(self, replicas: List[Replica], strategy: str = "round_robin", max_failures: int = 3, check_interval: float = 10):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown replica strategy '{strategy}'. Available: {', '.join(STRATEGIES)}")
+
+        self.replicas = replicas
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.check_interval = check_interval
+        self.counter = itertools.count()  # Round-robin position (`next` on it is atomic, so no lock is needed)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+
+    def choose(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if self.strategy == "least_latency":
+            return min(healthy, key=lambda replica: replica.latency or 0.0)  # Replicas not measured yet are tried first
+        return healthy[next(self.counter) % len(healthy)]
+
+
+    def ping(self, replica: Replica):
+        start = time.perf_counter()
+        try:
+            with replica.engine.connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+        except Exception as e:
+            self.record_failure(replica, e)
+        else:
+            self.record_success(replica, time.perf_counter() - start)
+
+
+    def record_success(self, replica: Replica, seconds: float):
+        with self.lock:
+            replica.latency = seconds if replica.latency is None else 0.8 * replica.latency + 0.2 * seconds
+            replica.failures = 0
+            if not replica.healthy:
+                logger.info(f"Read replica {replica.name} is back in rotation")
+            replica.healthy = True
+
+
+    def record_failure(self, replica: Replica, error: Exception):
+        with self.lock:
+            replica.failures += 1
+            replica.last_error = str(error)
+            if replica.healthy and replica.failures >= self.max_failures:
+                replica.healthy = False
+                logger.warning(f"Read replica {replica.name} taken out of rotation after {replica.failures} failed pings: {error}")
+
+
+    def check(self):
+        # Ejected replicas are pinged too, so they are put back once they recover
+        for replica in self.replicas:
+            self.ping(replica)
+
+
+    def start(self):
+        if self.thread is None and self.check_interval > 0:
+            self.thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+            self.thread.start()
+
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.check()
+            self.stopped.wait(self.check_interval)
+
+
+    def close(self):
+        self.stopped.set()
+        for replica in self.replicas:
+            replica.engine.dispose()
+        return self._dispose_async()
+
+
+    def forget(self):
+        """
+            Dropping the inherited connections in a forked worker without closing them (they belong to the parent process)
+        """
+
+        for replica in self.replicas:
+            replica.engine.dispose(close=False)
+            if replica.async_engine is not None:
+                replica.async_engine.sync_engine.dispose(close=False)
+
+
+    async def _dispose_async(self):
+        for replica in self.replicas:
+            if replica.async_engine is not None:
+                await replica.async_engine.dispose()
+
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "strategy": self.strategy,
+                "replicas": {
+                    replica.name: {
+                        "healthy": replica.healthy,
+                        "failures": replica.failures,
+                        "latency_ms": round(replica.latency * 1000, 3) if replica.latency is not None else None,
+                        "last_error": replica.last_error,
+                    } for replica in self.replicas
+                },
+            }
+
+
+class RoutingSession(Session):
+    """
+        Session which sends reads to a replica and everything else to the primary (the engine the session is bound to)
+
+        A statement counts as a read when it is a SELECT without FOR UPDATE, or when the caller says so
+        (`session.connection(bind_arguments={"read_only": True})`, for SQL sent straight to the driver).
+        The session stays on the replica it picked first, so its reads see one consistent database, and on the primary
+        once it has written (or `use_primary` was called). With `read_your_writes`, a write also pins the rest of the request to the primary.
+    """
+
+    def __init__(self, *args, replicas: Optional[ReplicaSet] = None, use_async_engines: bool = False, read_your_writes: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+        self.use_async_engines = use_async_engines
+        self.read_your_writes = read_your_writes
+        self.replica: Optional[Replica] = None
+
+
+    def get_bind(self, mapper=None, *, clause=None, read_only: Optional[bool] = None, **kwargs):
+        if self.replicas is None or kwargs.get("bind") is not None:
+            return super().get_bind(mapper, clause=clause, **kwargs)
+
+        if read_only is None:
+            read_only = not self._flushing and getattr(clause, "is_select", False) and getattr(clause, "_for_update_arg", None) is None
+            writes = self._flushing or getattr(clause, "is_dml", False)  # Other statements (e.g. a plain `session.connection()`) go to the primary without pinning
+        else:
+            writes = not read_only
+
+        pin = request_pin.get()
+        if writes:
+            self.info[PRIMARY] = True
+            if self.read_your_writes and pin is not None:
+                pin.pinned = True
+        elif read_only and not self.info.get(PRIMARY) and not (pin is not None and pin.pinned):
+            if self.replica is None or not self.replica.healthy:
+                self.replica = self.replicas.choose()
+            if self.replica is not None:
+                return self.replica.query_engine(self.use_async_engines)
+
+        return super().get_bind(mapper, clause=clause, **kwargs)
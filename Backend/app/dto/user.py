@@ -1,16 +1,62 @@
 from pydantic import BaseModel  # A class for defining the schema and data validation rules (expected fields, data types and any constraints or rules that should be applied to them)
-from typing import Optional
-from datetime import datetime, date
+from typing import Dict, List, Optional
+from datetime import date, datetime as DateTime  # Aliased, as the `datetime` field below would otherwise hide the type from its own annotation
 
 
 class UserDTO(BaseModel):
-    id: Optional[int]
-    name: Optional[str]
-    age: Optional[int]
-    email: Optional[str]
-    birthday: Optional[date]
-    datetime: Optional[datetime]
+    id: Optional[int] = None
+    name: Optional[str] = None
+    age: Optional[int] = None
+    email: Optional[str] = None
+    birthday: Optional[date] = None
+    datetime: Optional[DateTime] = None
 
     # This allows Pydantic to handle SQLAlchemy objects as dictionaries
     class Config:
-        orm_mode = True
+        from_attributes = True
+
+
+class UserUpdateDTO(BaseModel):
+    # The fields to change - the ones left out (or null) keep their current value
+    name: Optional[str] = None
+    age: Optional[int] = None
+    email: Optional[str] = None
+    birthday: Optional[date] = None
+    datetime: Optional[DateTime] = None
+
+
+class UserMutationDTO(BaseModel):
+    id: int
+    status: str  # "updated", "deleted", or "queued" when the change is written in the background (write-behind)
+    submission: Optional[int] = None  # Number of a queued change - the log names it if the change cannot be written
+
+
+class UserPageDTO(BaseModel):
+    items: List[UserDTO]
+    next_cursor: Optional[str] = None  # Pass this back as `cursor` to get the next page (None on the last page)
+
+
+class BulkUserErrorDTO(BaseModel):
+    index: int  # Position of the failed record in the request body
+    email: Optional[str] = None
+    error: str
+
+
+class BulkUserResultDTO(BaseModel):
+    inserted: int = 0
+    updated: int = 0
+    failed: List[BulkUserErrorDTO] = []
+
+
+class UserStatsDTO(BaseModel):
+    total: int
+    min: Optional[int] = None
+    max: Optional[int] = None
+    mean: Optional[float] = None
+    older_than: Dict[int, int] = {}  # age -> number of users older than it
+    percentiles: Dict[str, Optional[int]] = {}  # e.g. "p90" -> the age 90% of the users are at or below
+    buckets: Optional[Dict[int, int]] = None  # age -> number of users (only when asked for)
+    stale: bool = False  # A write with an unknown effect on the ages is waiting for the next recount
+    last_reconciled: Optional[float] = None  # Unix time of the last recount from the database
+    last_drift: int = 0  # Correction made by the last recount
+    max_lag_seconds: Optional[float] = None  # With several workers: writes handled by other workers may be missing for up to this long
@@ -1,8 +1,149 @@
+import os
+import argparse
+import importlib
+import importlib.util
 import uvicorn  # Fast ASGI (Asynchronous Server Gateway Interface) server implementation. It allows to run Python web applications that are built using frameworks such as FastAPI.
-import Backend.app.config.app_config as config
+from Backend.app.utils.logger import handler, get_logger
+
+logger = get_logger(__name__)
+
+APP = "Backend.app.config.app_config:app"  # The FastAPI application object that will be run by the server
+
+
+def __getattr__(name: str):
+    # `Backend.app.main:app` still points to the app, but the app is only imported when it is asked for - the process which starts the
+    # workers does not need it (each worker imports it by itself), unless it is preloaded
+    if name == "app":
+        return importlib.import_module("Backend.app.config.app_config").app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """
+        Reading the server settings - each one can also be set with the environment variable in brackets
+    """
+
+    parser = argparse.ArgumentParser(prog="python -m Backend.app.main", description="Start the API server")
+    parser.add_argument("--production", action="store_true", default=os.getenv("SERVER_MODE", "development").lower() == "production",
+                        help="Production mode: several worker processes and no auto-reload (SERVER_MODE=production)")
+    parser.add_argument("--host", default=os.getenv("HOST"), help="Address to listen on (HOST) - localhost by default, 0.0.0.0 in production")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")), help="Port to listen on (PORT)")
+    parser.add_argument("--uds", default=os.getenv("UDS"), help="Unix socket to listen on instead of host/port, e.g. behind nginx (UDS)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)), help="Worker processes in production (WEB_CONCURRENCY), the CPU count by default")
+    parser.add_argument("--backlog", type=int, default=int(os.getenv("BACKLOG", "2048")), help="Connections waiting to be accepted before new ones are refused (BACKLOG)")
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE", "5")), help="Seconds an idle keep-alive connection is kept open (KEEP_ALIVE)")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")), help="Seconds a stopping worker gets to finish its requests (GRACEFUL_TIMEOUT)")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("MAX_REQUESTS", "0")) or None, help="Requests after which a worker is replaced, 0 for never (MAX_REQUESTS)")
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false", default=os.getenv("ACCESS_LOG", "true").lower() == "true",
+                        help="Do not log each request (ACCESS_LOG=false) - the app itself only records metrics for them")
+    parser.add_argument("--preload", action="store_true", default=os.getenv("PRELOAD", "false").lower() == "true",
+                        help="Import the app once and fork the workers from it (PRELOAD) - needs gunicorn")
+    args = parser.parse_args(argv)
+
+    if args.host is None:
+        args.host = "0.0.0.0" if args.production else "localhost"
+    args.workers = max(args.workers, 1)
+    return args
+
+
+def describe_event_loop() -> str:
+    # uvicorn's "auto" choices: uvloop and httptools (C implementations of the event loop and the HTTP parser) when they are installed
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return f"loop={loop}, http={http}"
+
+
+def run_development(args: argparse.Namespace):
+    # One process which restarts when a file changes - not for production
+    uvicorn.run(APP, host=args.host, port=args.port, uds=args.uds, reload=True)
+
+
+def run_uvicorn(args: argparse.Namespace):
+    """
+        Production server: uvicorn's process manager with `workers` processes sharing one listening socket
+
+        Each worker is a new Python process (spawned, not forked) which imports the app and creates its own connection pools.
+        Signals to the manager process:
+            SIGHUP - restarts the workers one at a time (e.g. to pick up a new release); the others keep serving in the meantime
+            SIGTTIN / SIGTTOU - one worker more / less
+            SIGTERM / SIGINT - stops, letting the workers finish their requests (up to `graceful_timeout` seconds)
+    """
+
+    uvicorn.run(
+        APP,
+        host=args.host,
+        port=args.port,
+        uds=args.uds,
+        workers=args.workers,
+        loop="auto",
+        http="auto",
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_max_requests=args.max_requests,
+        proxy_headers=True,  # Trust X-Forwarded-* from FORWARDED_ALLOW_IPS (127.0.0.1 by default), e.g. a reverse proxy on the same machine
+        access_log=args.access_log,  # One line per request (client, method, path, status)
+    )
+
+
+def run_gunicorn(args: argparse.Namespace):
+    """
+        Production server with `preload`: gunicorn imports the app once, then forks the workers from it
+
+        The workers share the memory of the imported modules (copy-on-write) and start without paying for the imports again.
+        Services already created at that point are dropped in each worker (see `ServiceContainer.reset_after_fork`),
+        so every worker opens its own database connections.
+        Signals to the gunicorn master: SIGHUP starts new workers and then stops the old ones gracefully, SIGTTIN / SIGTTOU add / remove one.
+    """
+
+    from gunicorn.app.base import BaseApplication
+
+    # The worker class moved to the `uvicorn-worker` package - the one in uvicorn itself is deprecated but still works
+    worker_class = "uvicorn_worker.UvicornWorker" if importlib.util.find_spec("uvicorn_worker") else "uvicorn.workers.UvicornWorker"
+
+    class Server(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"unix:{args.uds}" if args.uds else f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "worker_class": worker_class,
+                "backlog": args.backlog,
+                "keepalive": args.keep_alive,
+                "graceful_timeout": args.graceful_timeout,
+                "max_requests": args.max_requests or 0,
+                "max_requests_jitter": (args.max_requests or 0) // 10,  # So the workers are not all replaced at the same time
+                "preload_app": True,
+                "accesslog": "-" if args.access_log else None,  # The workers' request log, written to stdout
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+
+        def load(self):
+            return importlib.import_module("Backend.app.config.app_config").app
+
+    Server().run()
+
+
+def main(argv=None):
+    handler.listener.start()
+    args = parse_args(argv)
+    if not args.production:
+        # Start the server and run the application on http://localhost:8000
+        run_development(args)
+        return
+
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)  # Inherited by the workers, so per-process state (e.g. the user stats) knows it is not alone
+    address = args.uds or f"{args.host}:{args.port}"
+    if args.preload:
+        if importlib.util.find_spec("gunicorn") is None:
+            raise SystemExit("--preload needs gunicorn (pip install gunicorn), which is not available on Windows")
+        logger.info(f"Starting {args.workers} preloaded gunicorn workers on {address} ({describe_event_loop()})")
+        run_gunicorn(args)
+    else:
+        logger.info(f"Starting {args.workers} uvicorn workers on {address} ({describe_event_loop()})")
+        run_uvicorn(args)
 
-app = config.app  # The FastAPI application object that will be run by the server
 
 if __name__ == "__main__":
-    # Start the server and run the application on http://localhost:8000
-    uvicorn.run("Backend.app.main:app", host="localhost", port=8000, reload=True)
\ No newline at end of file
+    main()
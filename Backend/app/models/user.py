@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, Float, String, Boolean
+from sqlalchemy import Column, Index, Integer, Float, String, Boolean
 from sqlalchemy.dialects.mssql import DATETIMEOFFSET, DATE
 
 SQLBaseModel = declarative_base()
@@ -12,6 +12,10 @@ class UserDataModel(SQLBaseModel):
     email = Column(type_=String, nullable=False, unique=True)
     birthday = Column(type_=DATE, nullable=False)
     datetime = Column(type_=DATETIMEOFFSET(0), nullable=True)
+
+    __table_args__ = (
+        Index("ix_users_age_id", "age", "id"),  # Serves the `ORDER BY age, id` of the paginated/streamed queries without a sort
+    )
     
 # `Column` parameters:
 # type_: The data type of the column (e.g. Integer, String, DateTime, ...)
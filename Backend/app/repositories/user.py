@@ -0,0 +1,429 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import Integer, bindparam, delete, func, insert, lambda_stmt, select, update, and_, or_
+from sqlalchemy.orm import Session
+from Backend.app.models.user import UserDataModel
+from Backend.app.utils.user_stats import user_stats
+from Backend.app.utils.settings import parse_mapping
+
+
+# Every backend works on a synchronous Session and leaves committing to the caller, so one repository call can be part of a larger transaction.
+# With read replicas configured, the reads may be served by a replica; the writes (and everything after them in the same session) go to the primary
+# - the writes are single statements, which `RoutingSession` recognises.
+# The writes also report the ages they add/remove to `user_stats` (counted once the session commits).
+# From async code they are called through `await session.run_sync(user_repository.<operation>, ...)`, which works for both session types of `open_session`.
+
+OPERATIONS = ("names_older_than", "rows_older_than", "oldest", "page", "age_counts", "add", "update", "delete")
+WRITE_OPERATIONS = ("add", "update", "delete", "delete_returning")
+COLUMNS = ("id", "name", "age", "email", "birthday", "datetime")
+UPDATABLE_FIELDS = ("name", "age", "email", "birthday", "datetime")
+
+users_table = UserDataModel.__table__
+
+
+class UserBackend(ABC):
+    """
+        One way of running the user queries (ORM, Core or DBAPI)
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def names_older_than(self, session: Session, age: int) -> List[str]:
+        """
+            Names of the users older than `age`, youngest first
+        """
+
+    @abstractmethod
+    def rows_older_than(self, session: Session, age: int, fields: Tuple[str, ...]) -> List[tuple]:
+        """
+            Only the `fields` columns (names from `COLUMNS`) of the users older than `age`, as plain tuples in (age, id) order
+        """
+
+    @abstractmethod
+    def oldest(self, session: Session, age: int, limit: int = 5) -> List[Tuple[str, str]]:
+        """
+            (name, email) of the `limit` oldest users older than `age`
+        """
+
+    @abstractmethod
+    def page(self, session: Session, age: int, after: Optional[Tuple[int, int]], limit: int) -> Sequence[Any]:
+        """
+            Up to `limit` users older than `age` in (age, id) order, starting after the (age, id) in `after`
+
+            The items have the user columns as attributes (model instances or rows).
+        """
+
+    @abstractmethod
+    def age_counts(self, session: Session) -> List[Tuple[int, int]]:
+        """
+            (age, number of users) for every age
+        """
+
+    @abstractmethod
+    def add(self, session: Session, name, age, email, birthday, datetime) -> None:
+        ...
+
+    @abstractmethod
+    def update(self, session: Session, user_id: int, fields: Dict[str, Any]) -> bool:
+        """
+            Setting the given fields (None values are left unchanged), returning whether the user exists
+        """
+
+    @abstractmethod
+    def delete(self, session: Session, user_id: int) -> bool:
+        ...
+
+
+class OrmUserBackend(UserBackend):
+    """
+        ORM queries on mapped objects
+
+        The SELECTs are lambda statements: the lambda is only run to build the statement the first time, after which SQLAlchemy
+        reuses the statement and its compiled SQL (keyed on the lambda's code), only swapping in the new parameter values.
+    """
+
+    name = "orm"
+
+    def names_older_than(self, session, age):
+        # Only the column is selected: loading whole objects (identity map, attribute state) to read one field costs ~5x on this route
+        statement = lambda_stmt(lambda: select(UserDataModel.name).where(UserDataModel.age > age).order_by(UserDataModel.age))
+        return list(session.scalars(statement))
+
+
+    def rows_older_than(self, session, age, fields):
+        # Selecting columns instead of the entity returns rows, so no objects are created or tracked by the session
+        columns = [getattr(UserDataModel, field) for field in fields]
+        statement = select(*columns).where(UserDataModel.age > age).order_by(UserDataModel.age, UserDataModel.id)
+        return [tuple(row) for row in session.execute(statement)]
+
+
+    def oldest(self, session, age, limit=5):
+        statement = lambda_stmt(lambda: select(UserDataModel).where(UserDataModel.age > age).order_by(UserDataModel.age.desc()).limit(limit))
+        return [(user.name, user.email) for user in session.scalars(statement)]
+
+
+    def page(self, session, age, after, limit):
+        statement = lambda_stmt(lambda: select(UserDataModel).where(UserDataModel.age > age))
+        if after is not None:
+            last_age, last_id = after
+            # Equivalent to `(age, id) > (last_age, last_id)`, written out because SQL Server does not support row-value comparisons
+            statement += lambda s: s.where(or_(UserDataModel.age > last_age, and_(UserDataModel.age == last_age, UserDataModel.id > last_id)))
+        statement += lambda s: s.order_by(UserDataModel.age, UserDataModel.id).limit(limit)
+        return session.scalars(statement).all()
+
+
+    def age_counts(self, session):
+        statement = select(UserDataModel.age, func.count()).group_by(UserDataModel.age)
+        return [tuple(row) for row in session.execute(statement)]
+
+
+    def add(self, session, name, age, email, birthday, datetime):
+        session.add(UserDataModel(name=name, age=age, email=email, birthday=birthday, datetime=datetime))
+        user_stats.record(session, added=[age])
+
+
+    def update(self, session, user_id, fields):
+        # One ORM-enabled UPDATE of the provided fields - the user is not loaded first, which would cost a second round trip
+        # (objects of this user already in the session are updated in memory too, without SQL)
+        values = {field: value for field, value in fields.items() if value is not None}
+        if not values:
+            return session.scalar(select(UserDataModel.id).where(UserDataModel.id == user_id)) is not None
+
+        updated = session.execute(update(UserDataModel).where(UserDataModel.id == user_id).values(values)).rowcount > 0
+        if updated and "age" in values:
+            user_stats.record_unknown(session)  # The previous age is not known without reading it first
+        return updated
+
+
+    def delete(self, session, user_id):
+        statement = delete(UserDataModel).where(UserDataModel.id == user_id)
+        if session.get_bind(clause=statement).dialect.delete_returning:
+            ages = session.scalars(statement.returning(UserDataModel.age)).all()
+            user_stats.record(session, removed=ages)
+            return len(ages) > 0
+
+        deleted = session.execute(statement).rowcount > 0
+        if deleted:
+            user_stats.record_unknown(session)
+        return deleted
+
+
+class CoreUserBackend(UserBackend):
+    """
+        Core statements, built once when this module is imported
+
+        The values are bound parameters, so every call runs the same statement object and the engine's compiled cache
+        returns its SQL without compiling it again.
+    """
+
+    name = "core"
+
+    NAMES_OLDER_THAN = select(users_table.c.name).where(users_table.c.age > bindparam("age")).order_by(users_table.c.age)
+    OLDEST = select(users_table.c.name, users_table.c.email) \
+                .where(users_table.c.age > bindparam("age")) \
+                .order_by(users_table.c.age.desc()) \
+                .limit(bindparam("limit", type_=Integer, literal_execute=True))  # Rendered as a literal, as SQL Server does not accept a parameter in TOP
+    PAGE = select(users_table).where(users_table.c.age > bindparam("age"))
+    PAGE_FIRST = PAGE.order_by(users_table.c.age, users_table.c.id).limit(bindparam("limit", type_=Integer, literal_execute=True))
+    PAGE_AFTER = PAGE.where(or_(users_table.c.age > bindparam("last_age"), and_(users_table.c.age == bindparam("last_age"), users_table.c.id > bindparam("last_id")))) \
+                    .order_by(users_table.c.age, users_table.c.id) \
+                    .limit(bindparam("limit", type_=Integer, literal_execute=True))
+    ADD = insert(users_table)
+    # Only the provided fields change: COALESCE keeps the current value where the parameter is NULL
+    UPDATE = update(users_table) \
+                .where(users_table.c.id == bindparam("user_id")) \
+                .values({field: func.coalesce(bindparam(f"new_{field}", type_=users_table.c[field].type), users_table.c[field]) for field in UPDATABLE_FIELDS})
+    DELETE = delete(users_table).where(users_table.c.id == bindparam("user_id"))
+    DELETE_RETURNING = DELETE.returning(users_table.c.age)  # Tells the age of the deleted user (OUTPUT on SQL Server), for the stats
+    AGE_COUNTS = select(users_table.c.age, func.count()).group_by(users_table.c.age)
+
+    def __init__(self):
+        self.projections: Dict[Tuple[str, ...], Any] = {}  # fields -> SELECT of those columns, built once per combination
+
+
+    def names_older_than(self, session, age):
+        return list(session.scalars(self.NAMES_OLDER_THAN, {"age": age}))
+
+
+    def rows_older_than(self, session, age, fields):
+        statement = self.projections.get(fields)
+        if statement is None:
+            statement = self.projections[fields] = select(*(users_table.c[field] for field in fields)) \
+                                                        .where(users_table.c.age > bindparam("age")) \
+                                                        .order_by(users_table.c.age, users_table.c.id)
+        return [tuple(row) for row in session.execute(statement, {"age": age})]
+
+
+    def oldest(self, session, age, limit=5):
+        return [(row.name, row.email) for row in session.execute(self.OLDEST, {"age": age, "limit": limit})]
+
+
+    def page(self, session, age, after, limit):
+        if after is None:
+            return session.execute(self.PAGE_FIRST, {"age": age, "limit": limit}).all()
+        return session.execute(self.PAGE_AFTER, {"age": age, "last_age": after[0], "last_id": after[1], "limit": limit}).all()
+
+
+    def age_counts(self, session):
+        return [tuple(row) for row in session.execute(self.AGE_COUNTS)]
+
+
+    def add(self, session, name, age, email, birthday, datetime):
+        session.execute(self.ADD, {"name": name, "age": age, "email": email, "birthday": birthday, "datetime": datetime})
+        user_stats.record(session, added=[age])
+
+
+    def update(self, session, user_id, fields):
+        parameters = {f"new_{field}": fields.get(field) for field in UPDATABLE_FIELDS}
+        updated = session.execute(self.UPDATE, {"user_id": user_id, **parameters}).rowcount > 0
+        if updated and fields.get("age") is not None:
+            user_stats.record_unknown(session)  # The previous age is not known without reading it first
+        return updated
+
+
+    def delete(self, session, user_id):
+        if session.get_bind(clause=self.DELETE).dialect.delete_returning:
+            ages = session.scalars(self.DELETE_RETURNING, {"user_id": user_id}).all()
+            user_stats.record(session, removed=ages)
+            return len(ages) > 0
+
+        deleted = session.execute(self.DELETE, {"user_id": user_id}).rowcount > 0
+        if deleted:
+            user_stats.record_unknown(session)
+        return deleted
+
+
+class DbapiUserBackend(UserBackend):
+    """
+        Plain SQL strings sent straight to the driver (`exec_driver_sql` - no statement building or compiling)
+
+        The SQL is written once per dialect and the same string is reused for every call, so drivers which prepare statements
+        (pyODBC re-uses the prepared statement when a cursor runs the same SQL again) and the server's plan cache both get hits.
+    """
+
+    name = "dbapi"
+
+    # operation -> (SQL, order of the parameters); "mssql" has its own versions, as SQL Server uses TOP instead of LIMIT
+    SQL = {
+        "default": {
+            "names_older_than": ("SELECT name FROM users WHERE age > ? ORDER BY age", ("age",)),
+            "oldest": ("SELECT name, email FROM users WHERE age > ? ORDER BY age DESC LIMIT ?", ("age", "limit")),
+            "page_first": ("SELECT id, name, age, email, birthday, datetime FROM users WHERE age > ? ORDER BY age, id LIMIT ?", ("age", "limit")),
+            "page_after": (
+                "SELECT id, name, age, email, birthday, datetime FROM users WHERE age > ? AND (age > ? OR (age = ? AND id > ?)) ORDER BY age, id LIMIT ?",
+                ("age", "last_age", "last_age", "last_id", "limit"),
+            ),
+        },
+        "mssql": {
+            "oldest": ("SELECT TOP (?) name, email FROM users WHERE age > ? ORDER BY age DESC", ("limit", "age")),
+            "page_first": ("SELECT TOP (?) id, name, age, email, birthday, datetime FROM users WHERE age > ? ORDER BY age, id", ("limit", "age")),
+            "page_after": (
+                "SELECT TOP (?) id, name, age, email, birthday, datetime FROM users WHERE age > ? AND (age > ? OR (age = ? AND id > ?)) ORDER BY age, id",
+                ("limit", "age", "last_age", "last_age", "last_id"),
+            ),
+        },
+    }
+    SQL["default"].update({
+        "add": ("INSERT INTO users (name, age, email, birthday, datetime) VALUES (?, ?, ?, ?, ?)", ("name", "age", "email", "birthday", "datetime")),
+        "update": (
+            "UPDATE users SET name = COALESCE(?, name), age = COALESCE(?, age), email = COALESCE(?, email), birthday = COALESCE(?, birthday), datetime = COALESCE(?, datetime) WHERE id = ?",
+            ("name", "age", "email", "birthday", "datetime", "user_id"),
+        ),
+        "delete": ("DELETE FROM users WHERE id = ?", ("user_id",)),
+        "delete_returning": ("DELETE FROM users WHERE id = ? RETURNING age", ("user_id",)),  # Tells the age of the deleted user, for the stats
+        "age_counts": ("SELECT age, COUNT(*) FROM users GROUP BY age", ()),
+    })
+    SQL["mssql"]["delete_returning"] = ("DELETE FROM users OUTPUT deleted.age WHERE id = ?", ("user_id",))
+
+    def __init__(self):
+        self.statements: Dict[tuple, Tuple[str, tuple]] = {}  # (dialect, paramstyle, query) -> (SQL, parameter order)
+        self.projections: Dict[str, Tuple[str, tuple]] = {}  # SELECTs of a set of columns, the same for every dialect
+
+
+    @classmethod
+    def sql(cls, dialect_name: str, query: str) -> Tuple[str, tuple]:
+        """
+            The SQL (with `?` placeholders) and parameter order of a query for a dialect - also used by the pyODBC examples
+        """
+
+        return cls.SQL.get(dialect_name, {}).get(query) or cls.SQL["default"][query]
+
+
+    def _execute(self, session: Session, query: str, **parameters):
+        # The SQL is not a statement object the session can inspect, so it is told whether the query only reads (see `RoutingSession`)
+        connection = session.connection(bind_arguments={"read_only": query not in WRITE_OPERATIONS})
+        dialect = connection.dialect
+        key = (dialect.name, dialect.paramstyle, query)
+        statement = self.statements.get(key)
+        if statement is None:
+            sql, order = self.projections.get(query) or self.sql(dialect.name, query)
+            if dialect.paramstyle in ("format", "pyformat"):
+                sql = sql.replace("?", "%s")  # e.g. psycopg2 and pymysql
+            statement = self.statements[key] = (sql, order)
+
+        sql, order = statement
+        return connection.exec_driver_sql(sql, tuple(parameters[name] for name in order))
+
+
+    def names_older_than(self, session, age):
+        return [row[0] for row in self._execute(session, "names_older_than", age=age)]
+
+
+    def rows_older_than(self, session, age, fields):
+        query = "rows_older_than:" + ",".join(fields)
+        if query not in self.projections:
+            unknown = [field for field in fields if field not in COLUMNS]
+            if unknown:
+                raise ValueError(f"Unknown user columns: {', '.join(unknown)}")  # Checked, as the names are put into the SQL
+            self.projections[query] = (f"SELECT {', '.join(fields)} FROM users WHERE age > ? ORDER BY age, id", ("age",))
+        return [tuple(row) for row in self._execute(session, query, age=age)]
+
+
+    def oldest(self, session, age, limit=5):
+        return [(row[0], row[1]) for row in self._execute(session, "oldest", age=age, limit=limit)]
+
+
+    def page(self, session, age, after, limit):
+        if after is None:
+            return self._execute(session, "page_first", age=age, limit=limit).all()
+        return self._execute(session, "page_after", age=age, last_age=after[0], last_id=after[1], limit=limit).all()
+
+
+    def age_counts(self, session):
+        return [tuple(row) for row in self._execute(session, "age_counts")]
+
+
+    def add(self, session, name, age, email, birthday, datetime):
+        self._execute(session, "add", name=name, age=age, email=email, birthday=birthday, datetime=datetime)
+        user_stats.record(session, added=[age])
+
+
+    def update(self, session, user_id, fields):
+        parameters = {field: fields.get(field) for field in UPDATABLE_FIELDS}
+        updated = self._execute(session, "update", user_id=user_id, **parameters).rowcount > 0
+        if updated and fields.get("age") is not None:
+            user_stats.record_unknown(session)  # The previous age is not known without reading it first
+        return updated
+
+
+    def delete(self, session, user_id):
+        if session.connection(bind_arguments={"read_only": False}).dialect.delete_returning:
+            ages = [row[0] for row in self._execute(session, "delete_returning", user_id=user_id)]
+            user_stats.record(session, removed=ages)
+            return len(ages) > 0
+
+        deleted = self._execute(session, "delete", user_id=user_id).rowcount > 0
+        if deleted:
+            user_stats.record_unknown(session)
+        return deleted
+
+
+BACKENDS = {backend.name: backend for backend in (OrmUserBackend, CoreUserBackend, DbapiUserBackend)}
+
+
+class UserRepository():
+    """
+        The user queries, each run by the backend configured for it
+
+        All backends return the same shapes, so which one serves an operation can be changed in the configuration
+        (e.g. DBAPI for the hot read path, ORM for the rest) without touching the callers.
+    """
+
+    def __init__(self, default: str = "orm", overrides: Optional[Dict[str, str]] = None):
+        overrides = overrides or {}
+        unknown = [name for name in (default, *overrides.values()) if name not in BACKENDS] + [operation for operation in overrides if operation not in OPERATIONS]
+        if unknown:
+            raise ValueError(f"Unknown user repository backends/operations: {', '.join(unknown)}")
+
+        self.backends = {name: backend() for name, backend in BACKENDS.items()}
+        self.selected = {operation: self.backends[overrides.get(operation, default)] for operation in OPERATIONS}
+
+
+    def backend(self, name: str) -> UserBackend:
+        return self.backends[name]
+
+
+    def describe(self) -> Dict[str, str]:
+        # operation -> name of the backend serving it
+        return {operation: backend.name for operation, backend in self.selected.items()}
+
+
+    def names_older_than(self, session: Session, age: int) -> List[str]:
+        return self.selected["names_older_than"].names_older_than(session, age)
+
+
+    def rows_older_than(self, session: Session, age: int, fields: Tuple[str, ...]) -> List[tuple]:
+        return self.selected["rows_older_than"].rows_older_than(session, age, tuple(fields))
+
+
+    def oldest(self, session: Session, age: int, limit: int = 5) -> List[Tuple[str, str]]:
+        return self.selected["oldest"].oldest(session, age, limit)
+
+
+    def page(self, session: Session, age: int, after: Optional[Tuple[int, int]], limit: int) -> Sequence[Any]:
+        return self.selected["page"].page(session, age, after, limit)
+
+
+    def age_counts(self, session: Session) -> List[Tuple[int, int]]:
+        return self.selected["age_counts"].age_counts(session)
+
+
+    def add(self, session: Session, name, age, email, birthday, datetime) -> None:
+        self.selected["add"].add(session, name, age, email, birthday, datetime)
+
+
+    def update(self, session: Session, user_id: int, fields: Dict[str, Any]) -> bool:
+        return self.selected["update"].update(session, user_id, fields)
+
+
+    def delete(self, session: Session, user_id: int) -> bool:
+        return self.selected["delete"].delete(session, user_id)
+
+
+# USER_REPOSITORY_BACKEND is used for every operation, USER_REPOSITORY_BACKENDS overrides it per operation, e.g. "names_older_than=dbapi,page=core"
+user_repository = UserRepository(
+    default=os.getenv("USER_REPOSITORY_BACKEND", "orm").lower(),
+    overrides={operation: backend.lower() for operation, backend in parse_mapping(os.getenv("USER_REPOSITORY_BACKENDS", "")).items()},
+)
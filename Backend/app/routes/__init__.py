@@ -1,5 +1,7 @@
-from fastapi import APIRouter  # Allows to define and organise routes for an API
+from fastapi import APIRouter, Security  # Allows to define and organise routes for an API
+from Backend.app.config.ad_config import azure_scheme
 from Backend.app.routes.user import router as user_router
+from Backend.app.routes.status import router as status_router
 
 # A router is an object that is responsible for handling the routing and dispatching of incoming HTTP requests to the appropriate endpoint functions
 router = APIRouter() 
@@ -7,4 +9,10 @@ router.include_router(
     router=user_router,  # The router object to be included in the application
     prefix="/users",  # The prefix or base path that will be added to all the routes. For example, if the route is defined as @router.get("/user") then the endpoint will be accessible at "api/users/user".
     tags=["users"]  # Tags help to group and organise routes (i.e. contain related endpoints)
+)
+router.include_router(
+    router=status_router,
+    prefix="/status",  # Service diagnostics, e.g. "api/status/pool"
+    tags=["status"],
+    dependencies=[Security(dependency=azure_scheme, scopes=["Status.Read"])]  # They reveal secret names, replica hosts and driver errors, so only operators may read them
 )
\ No newline at end of file
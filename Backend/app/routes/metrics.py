@@ -0,0 +1,34 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from Backend.app.utils.metrics import render_metrics, render_gauge, render_counter
+from Backend.app.utils.logger import handler, RateLimitFilter
+from Backend.app.utils.cache import query_cache
+from Backend.app.config.db_config import get_pool_stats
+from Backend.app.config.ad_config import token_cache
+
+router = APIRouter()
+
+
+@router.get(path="/metrics", include_in_schema=False, response_class=PlainTextResponse)
+# Example request: https://localhost:8000/metrics (Prometheus text format)
+async def get_metrics():
+    lines = []
+
+    # Connection pools
+    pools = get_pool_stats()
+    connections = {(name, state): stats[state] for name, stats in pools.items() for state in ("checked_out", "idle", "overflow") if state in stats}
+    lines += render_gauge("db_pool_connections", "Connections per pool and state", connections, ("pool", "state"))
+    lines += render_counter("db_pool_checkouts_total", "Connection checkouts per pool", {(name,): stats["checkouts"] for name, stats in pools.items() if "checkouts" in stats}, ("pool",))
+    lines += render_counter("db_pool_wait_seconds_total", "Time spent waiting for connections per pool", {(name,): stats["wait_seconds_total"] for name, stats in pools.items() if "wait_seconds_total" in stats}, ("pool",))
+
+    # Caches
+    for name, stats in (("auth_token_cache", token_cache.stats()), ("query_cache", query_cache.backend.stats())):
+        lines += render_gauge(f"{name}_entries", "Entries in the cache", {(): stats["size"]})
+        lines += render_counter(f"{name}_requests_total", "Cache lookups by result", {("hit",): stats["hits"], ("miss",): stats["misses"]}, ("result",))
+
+    # Logging
+    suppressed = sum(log_filter.suppressed for log_filter in handler.filters if isinstance(log_filter, RateLimitFilter))
+    lines += render_counter("log_records_dropped_total", "Log records dropped because the queue was full", {(): handler.dropped})
+    lines += render_counter("log_warnings_suppressed_total", "Repeated warnings dropped by the rate limit", {(): suppressed})
+
+    return PlainTextResponse(render_metrics() + "\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
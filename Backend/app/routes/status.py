@@ -0,0 +1,59 @@
+from fastapi import APIRouter
+from Backend.app.config.db_config import get_pool_stats
+from Backend.app.utils.get_credentials import secret_provider
+from Backend.app.config.ad_config import token_cache
+from Backend.app.config.container import container
+from Backend.app.utils.singleflight import singleflight
+from Backend.app.utils.write_behind import user_write_behind
+
+router = APIRouter()
+
+
+@router.get(path="/pool")
+# Example request: https://localhost:8000/api/status/pool
+async def get_pool_status():
+    # Live connection pool usage - how many connections are in use/idle and how long requests waited for one
+    return get_pool_stats()
+
+
+@router.get(path="/secrets")
+# Example request: https://localhost:8000/api/status/secrets
+async def get_secrets_status():
+    # How long each secret took to load (the values are never returned)
+    return secret_provider.report()
+
+
+@router.get(path="/auth-cache")
+# Example request: https://localhost:8000/api/status/auth-cache
+async def get_auth_cache_status():
+    # Hit/miss counters of the verified token cache
+    return token_cache.stats()
+
+
+@router.get(path="/startup")
+# Example request: https://localhost:8000/api/status/startup
+async def get_startup_status():
+    # How long each service (engine, auth scheme, ...) took to create, and which ones have not been needed yet
+    return container.report()
+
+
+@router.get(path="/replicas")
+# Example request: https://localhost:8000/api/status/replicas
+async def get_replica_status():
+    # Health and ping latency of the read replicas (empty without replicas)
+    replicas = container.peek("db_replicas")
+    return replicas.report() if replicas is not None else {}
+
+
+@router.get(path="/singleflight")
+# Example request: https://localhost:8000/api/status/singleflight
+async def get_singleflight_status():
+    # How many database calls were saved by sharing identical concurrent user queries
+    return singleflight.stats()
+
+
+@router.get(path="/write-behind")
+# Example request: https://localhost:8000/api/status/write-behind
+async def get_write_behind_status():
+    # Queued user changes and the batches written so far (batch size and flush latency histograms are at /metrics)
+    return user_write_behind.stats()
@@ -1,33 +1,303 @@
-from fastapi import APIRouter, Depends, Security, HTTPException
-from Backend.app.utils.logger import logger
+import os
+import asyncio
+from datetime import date
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Query, Request, Security, HTTPException
+from fastapi.responses import Response, StreamingResponse  # Sends the response body in chunks as they are produced instead of all at once
+from Backend.app.utils.logger import get_logger
 from Backend.app.models.user import UserDataModel
-from Backend.app.dto.user import UserDTO
-from Backend.app.config.db_config import db_session
+from Backend.app.dto.user import UserDTO, UserPageDTO, UserStatsDTO, UserUpdateDTO, UserMutationDTO, BulkUserResultDTO
+from Backend.app.utils.bulk_queries import bulk_upsert_users, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE
+from Backend.app.utils.pagination import encode_cursor, decode_cursor
+from Backend.app.repositories.user import user_repository, COLUMNS
+from Backend.app.utils.serialization import dumps
+from Backend.app.utils import export
+from Backend.app.utils.user_stats import user_stats, refresh_user_stats
+from Backend.app.utils.cache import query_cache, make_etag, etag_matches, USERS
+from Backend.app.utils.singleflight import singleflight
+from Backend.app.utils.write_behind import user_write_behind, QueueFullError
+from Backend.app.config.db_config import open_session
 from Backend.app.config.ad_config import azure_scheme
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = get_logger(__name__)
 
 router = APIRouter()
 
-def connect_db():
-    db = db_session()  # Open a new session
-    try:
-        yield db
-    finally:
-        db.close()  # Close the session
+FAST_RESPONSES = os.getenv("FAST_RESPONSES", "false").lower() == "true"  # Default of the `fast` parameter of /list
+
+async def connect_db():
+    async with open_session() as session:  # Open a new session (closed automatically once the request is done)
+        yield session
+
+
+async def read_users(operation: str, *args):
+    """
+        Running a read of the user repository in a session of its own
+
+        Used through `singleflight`: identical requests arriving together share one call, which must not depend on the session of
+        the request that happened to start it.
+    """
+
+    async with open_session() as session:
+        return await session.run_sync(getattr(user_repository, operation), *args)
+
+
+def cached_response(request: Request, body: bytes, etag: str) -> Response:
+    # `no-cache` lets clients keep the body but makes them check it with the server (If-None-Match) before reusing it
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=headers)  # The client's copy is still current, so the body is not sent again
+    return Response(content=body, media_type="application/json", headers=headers)
         
 
-@router.get(path="/user", dependencies=Security(dependency=azure_scheme, scopes=["User.Read"]), response_model=UserDTO)
+@router.get(path="/user", dependencies=[Security(dependency=azure_scheme, scopes=["User.Read"])], response_model=List[str])
 # Example request: https://localhost:8000/api/users/user?age=30
-async def get_users_by_age(user_age: int, session: Session = Depends(connect_db)):  # This is the "request handler"/endpoint function
+async def get_users_by_age(user_age: int, request: Request):  # This is the "request handler"/endpoint function
+    key = query_cache.make_key(USERS, query="older_than", user_age=user_age)
+    cached = query_cache.get(key)  # (body, ETag) of an earlier identical query, until a write to the users table invalidates it
+
+    if cached is None:
+        try:
+            # Run by the backend configured for this query (see `repositories/user.py`); concurrent requests for the same age share one query
+            result = await singleflight.do(key, read_users, "names_older_than", user_age)
+            # Note: `await` hands control back to the event loop while the query runs, so other requests are served in the meantime
+            
+            if result:
+                body = dumps(result)  # orjson when installed
+            else:
+                logger.warning("No data found")
+                raise HTTPException(status_code=404, detail="No users found")
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.exception(f"Error fetching user data: {e}")
+            raise HTTPException(status_code=500, detail="Internal Server Error")
+
+        cached = (body, make_etag(body))
+        query_cache.set(key, cached)
+
+    return cached_response(request, *cached)
+
+
+@router.get(path="/list", dependencies=[Security(dependency=azure_scheme, scopes=["User.Read"])], response_model=List[UserDTO], response_model_exclude_unset=True)
+# Example request: https://localhost:8000/api/users/list?user_age=30&fields=name,email&fast=true
+async def get_user_list(request: Request, user_age: int, fields: Optional[str] = None, fast: bool = FAST_RESPONSES):
+    # `fields` limits both the response and the query to the listed columns (all of them when it is missing or lists none, e.g. "fields=,")
+    selected = tuple(dict.fromkeys(field.strip() for field in (fields or "").split(",") if field.strip())) or COLUMNS
+    unknown = [field for field in selected if field not in COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(COLUMNS)}")
+
+    if fast:
+        key = query_cache.make_key(USERS, query="list", user_age=user_age, fields=selected)
+        cached = query_cache.get(key)
+        if cached is not None:
+            return cached_response(request, *cached)
+
     try:
-        result = session.query(UserDataModel).filter(UserDataModel.age > user_age).order_by(UserDataModel.age).all()
-        # Note: `session.query` is synchronous so `await` is not needed
-        
-        if result:
-            return [user.name for user in result]
-        else:
-            logger.warning("No data found")
-            raise HTTPException(status_code=404, detail="No users found")
+        rows = await singleflight.do(query_cache.make_key(USERS, query="rows", user_age=user_age, fields=selected), read_users, "rows_older_than", user_age, selected)
     except Exception as e:
         logger.exception(f"Error fetching user data: {e}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    if not fast:
+        # Standard path: a UserDTO per row, which FastAPI validates against `response_model` and encodes
+        return [UserDTO(**dict(zip(selected, row))) for row in rows]
+
+    # Fast path: the rows come from our own table, so they are trusted - each becomes a dict with the DTO's field names
+    # (no pydantic model, no second validation against `response_model`) and the list is encoded in one call
+    body = dumps([dict(zip(selected, row)) for row in rows])
+    cached = (body, make_etag(body))
+    query_cache.set(key, cached)
+    return cached_response(request, *cached)
+
+
+@router.get(path="/page", dependencies=[Security(dependency=azure_scheme, scopes=["User.Read"])], response_model=UserPageDTO)
+# Example request: https://localhost:8000/api/users/page?user_age=30&limit=100&cursor=<next_cursor of the previous page>
+async def get_users_page(request: Request, user_age: int, limit: int = Query(default=100, ge=1, le=1000), cursor: Optional[str] = None):
+    key = query_cache.make_key(USERS, query="page", user_age=user_age, limit=limit, cursor=cursor)
+    cached = query_cache.get(key)
+    if cached is not None:
+        return cached_response(request, *cached)
+
+    # Keyset pagination: instead of skipping rows with OFFSET (which the database still has to read), each page continues after the (age, id) of the previous page's last row
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, int, int)  # (age, id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    try:
+        users = await singleflight.do(key, read_users, "page", user_age, after, limit + 1)  # One extra row tells whether there is a next page
+    except Exception as e:
+        logger.exception(f"Error fetching user data: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    next_cursor = None
+    if len(users) > limit:
+        last_user = users[limit - 1]
+        next_cursor = encode_cursor(last_user.age, last_user.id)
+
+    page = UserPageDTO(items=[UserDTO.model_validate(user) for user in users[:limit]], next_cursor=next_cursor)
+    body = page.model_dump_json().encode()
+    cached = (body, make_etag(body))
+    query_cache.set(key, cached)
+
+    return cached_response(request, *cached)
+
+
+@router.get(path="/stream", dependencies=[Security(dependency=azure_scheme, scopes=["User.Read"])])
+# Example request: https://localhost:8000/api/users/stream?user_age=30
+async def stream_users_by_age(user_age: int, batch_size: int = Query(default=1000, ge=1, le=10000)):
+    # The rows are sent as NDJSON (one JSON object per line) while they are read, so memory use does not depend on the number of matching rows
+    statement = select(UserDataModel.id, UserDataModel.name, UserDataModel.age, UserDataModel.email, UserDataModel.birthday, UserDataModel.datetime) \
+                    .filter(UserDataModel.age > user_age) \
+                    .order_by(UserDataModel.age, UserDataModel.id) \
+                    .execution_options(yield_per=batch_size)  # Fetch `batch_size` rows at a time through a server-side cursor
+
+    async def generate_lines():
+        # The session is opened here rather than through `connect_db`, as dependencies are closed before a streamed body is sent
+        try:
+            async with open_session() as session:
+                result = await session.stream(statement)
+                async for rows in result.partitions():
+                    yield b"".join(dumps(row._asdict()) + b"\n" for row in rows)  # The columns are the DTO's fields, so the rows are encoded as they are
+        except Exception as e:
+            # The status code has already been sent: raising aborts the chunked response, so the client sees a broken transfer
+            # rather than a stream which simply ends with fewer rows
+            logger.exception(f"Error streaming user data: {e}")
+            raise
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
+
+@router.get(path="/export", dependencies=[Security(dependency=azure_scheme, scopes=["User.Read"])])
+# Example request: https://localhost:8000/api/users/export?format=parquet&compression=zstd&min_age=30&born_after=1990-01-01
+async def export_users(file_format: str = Query(default="csv", alias="format"), compression: str = "none", min_age: Optional[int] = None, max_age: Optional[int] = None,
+                       born_after: Optional[date] = None, born_before: Optional[date] = None, batch_size: int = Query(default=5000, ge=100, le=50000)):
+    # Arrow IPC / Parquet need `pyarrow` and zstd needs `zstandard` - both optional, so the available choices are checked per request
+    if file_format not in export.available_formats():
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{file_format}'. Available: {', '.join(export.available_formats())}")
+    if compression not in export.available_compressions():
+        raise HTTPException(status_code=400, detail=f"Unsupported compression '{compression}'. Available: {', '.join(export.available_compressions())}")
+
+    statement = export.build_export_statement(min_age, max_age, born_after, born_before, batch_size)
+
+    async def generate_chunks():
+        # Each batch of rows is encoded, compressed and sent before the next one is read, so at most one batch is in memory
+        # (whatever the size of the table). Encoding and compressing take CPU time, so they run in a worker thread to keep the event loop free
+        encoder = export.create_encoder(file_format)
+        compressor = export.Compressor(compression)
+        try:
+            chunk = compressor.compress(encoder.begin())
+            if chunk:
+                yield chunk
+            async with open_session() as session:  # Opened here, as dependencies are closed before a streamed body is sent
+                result = await session.stream(statement)
+                async for rows in result.partitions():
+                    chunk = await asyncio.to_thread(lambda: compressor.compress(encoder.write_batch(rows)))
+                    if chunk:  # The compressor may keep small inputs until it has a full block
+                        yield chunk
+            yield compressor.compress(encoder.end()) + compressor.flush()
+        except Exception as e:
+            # The status code has already been sent: raising aborts the chunked response, so the client sees a broken transfer
+            # rather than a file which looks complete but is missing rows
+            logger.exception(f"Error exporting user data: {e}")
+            raise
+
+    headers = export.export_headers(file_format, compression)
+    return StreamingResponse(generate_chunks(), media_type=headers.pop("Content-Type"), headers=headers)
+
+
+@router.get(path="/stats", dependencies=[Security(dependency=azure_scheme, scopes=["User.Read"])], response_model=UserStatsDTO)
+# Example request: https://localhost:8000/api/users/stats?older_than=30&older_than=60&percentiles=50,90,99&buckets=true
+async def get_user_stats(older_than: List[int] = Query(default=[]), percentiles: str = "50,90,99", buckets: bool = False):
+    # Answered from the in-memory age histogram (see `utils/user_stats.py`) - no query is run, except to build it the first time
+    try:
+        quantiles = [float(value) for value in percentiles.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles must be a comma-separated list of numbers")
+    if any(not 0 <= q <= 100 for q in quantiles):
+        raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+
+    if not user_stats.loaded:
+        try:
+            await refresh_user_stats()
+        except Exception as e:
+            logger.exception(f"Error counting users: {e}")
+            raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    return user_stats.snapshot(older_than=older_than, percentiles=quantiles, include_buckets=buckets)
+
+
+@router.post(path="/bulk", dependencies=[Security(dependency=azure_scheme, scopes=["User.Write"])], response_model=BulkUserResultDTO)
+# Example request: POST https://localhost:8000/api/users/bulk?chunk_size=1000 with a JSON list of users as the body
+async def add_users_bulk(users: List[UserDTO], chunk_size: int = Query(default=DEFAULT_CHUNK_SIZE, ge=1, le=MAX_CHUNK_SIZE), session: AsyncSession = Depends(connect_db)):
+    # Records that cannot be written are listed in `failed`, the rest of the batch is still saved
+    try:
+        result = await session.run_sync(bulk_upsert_users, users, chunk_size)  # The bulk writer uses the synchronous Session API
+    except Exception as e:
+        logger.exception(f"Error adding users: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    if result.inserted or result.updated:
+        query_cache.invalidate(USERS)  # The cached user queries may now be out of date
+    if result.failed:
+        logger.warning(f"{len(result.failed)} of {len(users)} users could not be saved")
+
+    return result
+
+
+@router.patch(path="/{user_id}", dependencies=[Security(dependency=azure_scheme, scopes=["User.Write"])], response_model=UserMutationDTO)
+# Example request: PATCH https://localhost:8000/api/users/42 with {"datetime": "2024-10-24T14:30:00Z"} as the body
+async def update_user(user_id: int, changes: UserUpdateDTO, response: Response, session: AsyncSession = Depends(connect_db)):
+    fields = changes.model_dump(exclude_unset=True)
+    if user_write_behind.enabled:
+        return await queue_user_change(user_id, fields, response)
+
+    try:
+        updated = await session.run_sync(user_repository.update, user_id, fields)  # One UPDATE statement, the user is not loaded first
+        await session.commit()
+    except Exception as e:
+        logger.exception(f"Error updating user: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    if not updated:
+        raise HTTPException(status_code=404, detail="User not found")
+    query_cache.invalidate(USERS)
+    return UserMutationDTO(id=user_id, status="updated")
+
+
+@router.delete(path="/{user_id}", dependencies=[Security(dependency=azure_scheme, scopes=["User.Delete"])], response_model=UserMutationDTO)
+# Example request: DELETE https://localhost:8000/api/users/42
+async def delete_user(user_id: int, response: Response, session: AsyncSession = Depends(connect_db)):
+    if user_write_behind.enabled:
+        return await queue_user_change(user_id, None, response)
+
+    try:
+        deleted = await session.run_sync(user_repository.delete, user_id)
+        await session.commit()
+    except Exception as e:
+        logger.exception(f"Error deleting user: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    if not deleted:
+        raise HTTPException(status_code=404, detail="User not found")
+    query_cache.invalidate(USERS)
+    return UserMutationDTO(id=user_id, status="deleted")
+
+
+async def queue_user_change(user_id: int, fields: Optional[dict], response: Response) -> UserMutationDTO:
+    # Write-behind: the change is merged with the user's other pending changes and written with the next batch, so the response
+    # is "202 Accepted" - it does not say whether the user exists, and reads may not show the change for up to WRITE_BEHIND_FLUSH_INTERVAL seconds
+    try:
+        submission = await user_write_behind.submit(user_id, fields)
+    except QueueFullError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail="Too many pending changes, try again later", headers={"Retry-After": "1"})
+
+    response.status_code = 202
+    return UserMutationDTO(id=user_id, status="queued", submission=submission)
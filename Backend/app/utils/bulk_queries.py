@@ -0,0 +1,105 @@
+import os
+from typing import Dict, List, Tuple
+from Backend.app.utils.logger import get_logger
+from sqlalchemy import select, insert, update
+from sqlalchemy.orm import Session
+from Backend.app.models.user import UserDataModel
+from Backend.app.dto.user import UserDTO, BulkUserErrorDTO, BulkUserResultDTO
+from Backend.app.config.db_routing import use_primary
+from Backend.app.utils.user_stats import user_stats
+
+logger = get_logger(__name__)
+
+
+DEFAULT_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+MAX_CHUNK_SIZE = 2000  # SQL Server accepts at most 2100 parameters per statement (used by the `email IN (...)` lookup)
+USER_FIELDS = ("name", "age", "email", "birthday", "datetime")
+REQUIRED_FIELDS = ("name", "age", "email", "birthday")  # The NOT NULL columns of the `users` table
+
+
+def bulk_upsert_users(session: Session, users: List[UserDTO], chunk_size: int = DEFAULT_CHUNK_SIZE) -> BulkUserResultDTO:
+    """
+        Inserting or updating (matched on the unique `email`) a large batch of users
+
+        The records are written `chunk_size` at a time, with one multi-row INSERT and one executemany UPDATE per chunk and a commit after each chunk.
+        If a chunk fails, its records are retried one by one so only the offending records are reported in `failed`.
+    """
+
+    use_primary(session)  # The existing emails are looked up on the database the rows are written to
+    chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+    result = BulkUserResultDTO()
+
+    for start in range(0, len(users), chunk_size):
+        rows = _prepare_rows(users[start:start + chunk_size], start, result.failed)
+
+        try:
+            inserted, updated = _write_rows(session, rows)
+            session.commit()
+        except Exception:
+            session.rollback()
+            logger.warning(f"Bulk write of users {start}-{start + len(rows) - 1} failed, retrying them one by one")
+            inserted = updated = 0
+            for index, row in rows:
+                try:
+                    row_inserted, row_updated = _write_rows(session, [(index, row)])
+                    session.commit()
+                    inserted += row_inserted
+                    updated += row_updated
+                except Exception as e:
+                    session.rollback()
+                    result.failed.append(BulkUserErrorDTO(index=index, email=row["email"], error=str(getattr(e, "orig", e))))
+
+        result.inserted += inserted
+        result.updated += updated
+
+    return result
+
+
+def _prepare_rows(users: List[UserDTO], start: int, failed: List[BulkUserErrorDTO]) -> List[Tuple[int, Dict]]:
+    """
+        Turning a chunk of DTOs into column dictionaries, reporting the records which cannot be written
+    """
+
+    rows_by_email = {}
+    for index, user in enumerate(users, start):
+        row = user.model_dump(include=set(USER_FIELDS))
+        missing = [field for field in REQUIRED_FIELDS if row[field] is None]
+
+        if missing:
+            failed.append(BulkUserErrorDTO(index=index, email=row["email"], error=f"Missing required fields: {', '.join(missing)}"))
+        elif row["email"] in rows_by_email:
+            # The same email twice in one statement would violate the unique constraint - the last record wins, as it would across chunks
+            replaced_index, _ = rows_by_email[row["email"]]
+            failed.append(BulkUserErrorDTO(index=replaced_index, email=row["email"], error=f"Duplicate email, superseded by record {index}"))
+            rows_by_email[row["email"]] = (index, row)
+        else:
+            rows_by_email[row["email"]] = (index, row)
+
+    return sorted(rows_by_email.values(), key=lambda item: item[0])
+
+
+def _write_rows(session: Session, rows: List[Tuple[int, Dict]]) -> Tuple[int, int]:
+    """
+        Writing a chunk of rows: existing emails are updated, the rest inserted
+    """
+
+    if not rows:
+        return 0, 0
+
+    emails = [row["email"] for _, row in rows]
+    existing = {email: (user_id, age) for email, user_id, age in session.execute(select(UserDataModel.email, UserDataModel.id, UserDataModel.age).where(UserDataModel.email.in_(emails)))}
+
+    new_rows = [row for _, row in rows if row["email"] not in existing]
+    changed_rows = [{**row, "id": existing[row["email"]][0]} for _, row in rows if row["email"] in existing]
+
+    # Passing a list of dictionaries makes SQLAlchemy send the rows in bulk (multi-row VALUES, or pyODBC's `fast_executemany`) instead of one statement per row
+    if new_rows:
+        session.execute(insert(UserDataModel), new_rows)
+    if changed_rows:
+        session.execute(update(UserDataModel), changed_rows)  # Bulk UPDATE ... WHERE id = ? for each dictionary
+
+    # The age histogram of `/stats` - the previous ages came with the lookup above
+    moved = [(row["age"], existing[row["email"]][1]) for row in changed_rows if row["age"] != existing[row["email"]][1]]
+    user_stats.record(session, added=[row["age"] for row in new_rows] + [new for new, _ in moved], removed=[old for _, old in moved])
+
+    return len(new_rows), len(changed_rows)
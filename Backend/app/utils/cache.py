@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+from Backend.app.utils.lru_cache import LRUCache
+
+
+class CacheBackend(ABC):
+    """
+        Where cached values are stored
+
+        Implement this to share the cache between processes (e.g. Redis); `InMemoryCache` is the in-process version.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float):
+        ...
+
+    @abstractmethod
+    def get_counter(self, name: str) -> int:
+        ...
+
+    @abstractmethod
+    def incr(self, name: str) -> int:
+        ...
+
+
+class InMemoryCache(LRUCache, CacheBackend):
+    """
+        A size-limited LRU cache with a time-to-live per entry
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        super().__init__(max_entries)
+        self.counters: Dict[str, int] = {}  # Kept apart from the entries, so they are never evicted
+
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.put(key, value, self.clock() + ttl)
+
+
+    def get_counter(self, name: str) -> int:
+        with self.lock:
+            return self.counters.get(name, 0)
+
+
+    def incr(self, name: str) -> int:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            return self.counters[name]
+
+
+class QueryCache():
+    """
+        Read-through cache of query results, grouped in namespaces (e.g. "users")
+
+        Every namespace has a generation number which is part of its keys. Invalidating a namespace increments it, so all its earlier entries
+        stop matching at once (and age out of the backend) - writes do not have to know which queries they affect.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float = 60):
+        self.backend = backend
+        self.ttl = ttl
+
+
+    def make_key(self, namespace: str, **params) -> str:
+        generation = self.backend.get_counter(f"{namespace}:generation")
+        normalized = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)  # The same parameters give the same key whatever their order
+        return f"{namespace}:{generation}:{normalized}"
+
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.backend.get(key)
+
+
+    def set(self, key: str, value: Any):
+        self.backend.set(key, value, self.ttl)
+
+
+    def invalidate(self, namespace: str):
+        self.backend.incr(f"{namespace}:generation")
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+        Checking an `If-None-Match` request header (a list of ETags, or "*") against the current ETag
+    """
+
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+USERS = "users"  # Namespace of the user query results
+
+# Entries live for QUERY_CACHE_TTL seconds at most - this also bounds how stale other worker processes can be, as invalidation is per process
+query_cache = QueryCache(
+    InMemoryCache(max_entries=int(os.getenv("QUERY_CACHE_SIZE", "1024"))),
+    ttl=float(os.getenv("QUERY_CACHE_TTL", "60")),
+)
@@ -0,0 +1,183 @@
+import io
+import csv
+import zlib
+from datetime import date
+from typing import List, Optional, Sequence
+from sqlalchemy import select
+from Backend.app.models.user import UserDataModel
+
+# Optional libraries - without them the formats/compression they provide are reported as unavailable
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+EXPORT_COLUMNS = ("id", "name", "age", "email", "birthday", "datetime")
+
+FORMATS = {
+    # format -> (content type, file extension)
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+COMPRESSIONS = {
+    # compression -> (content type, file extension)
+    "none": (None, None),
+    "gzip": ("application/gzip", "gz"),
+    "zstd": ("application/zstd", "zst"),
+}
+
+
+def available_formats() -> List[str]:
+    return [name for name in FORMATS if name == "csv" or pyarrow is not None]
+
+
+def available_compressions() -> List[str]:
+    return [name for name in COMPRESSIONS if name != "zstd" or zstandard is not None]
+
+
+def build_export_statement(min_age: Optional[int], max_age: Optional[int], born_after: Optional[date], born_before: Optional[date], batch_size: int):
+    """
+        SELECT of the exported columns with the optional filters, read `batch_size` rows at a time through a server-side cursor
+    """
+
+    statement = select(*(getattr(UserDataModel, column) for column in EXPORT_COLUMNS))
+    if min_age is not None:
+        statement = statement.where(UserDataModel.age >= min_age)
+    if max_age is not None:
+        statement = statement.where(UserDataModel.age <= max_age)
+    if born_after is not None:
+        statement = statement.where(UserDataModel.birthday >= born_after)
+    if born_before is not None:
+        statement = statement.where(UserDataModel.birthday < born_before)
+
+    return statement.order_by(UserDataModel.id).execution_options(yield_per=batch_size)
+
+
+class CsvEncoder():
+    """
+        Rows as CSV with a header line
+    """
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = columns
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator="\n")
+
+
+    def _drain(self) -> bytes:
+        data = self.buffer.getvalue().encode()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+    def begin(self) -> bytes:
+        self.writer.writerow(self.columns)
+        return self._drain()
+
+
+    def write_batch(self, rows) -> bytes:
+        self.writer.writerows(rows)
+        return self._drain()
+
+
+    def end(self) -> bytes:
+        return b""
+
+
+class ArrowEncoder():
+    """
+        Rows as an Arrow IPC stream (one record batch per database batch) or a Parquet file (one row group per batch)
+
+        The writer writes into an in-memory buffer which is emptied after every batch, so only one batch is held at a time.
+    """
+
+    def __init__(self, columns: Sequence[str], file_format: str):
+        self.columns = columns
+        self.schema = pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("name", pyarrow.string()),
+            ("age", pyarrow.int32()),
+            ("email", pyarrow.string()),
+            ("birthday", pyarrow.date32()),
+            ("datetime", pyarrow.timestamp("us", tz="UTC")),
+        ])
+        self.sink = io.BytesIO()
+        if file_format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(self.sink, self.schema)
+            self.write = self.writer.write_table
+            self.to_batch = pyarrow.Table.from_arrays
+        else:
+            self.writer = pyarrow.ipc.new_stream(self.sink, self.schema)
+            self.write = self.writer.write_batch
+            self.to_batch = pyarrow.RecordBatch.from_arrays
+
+
+    def _drain(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+
+    def begin(self) -> bytes:
+        return self._drain()
+
+
+    def write_batch(self, rows) -> bytes:
+        values = list(zip(*rows))  # Rows to columns
+        arrays = [pyarrow.array(column, type=field.type) for column, field in zip(values, self.schema)]
+        self.write(self.to_batch(arrays, schema=self.schema))
+        return self._drain()
+
+
+    def end(self) -> bytes:
+        self.writer.close()  # Writes the end-of-stream marker / Parquet footer
+        return self._drain()
+
+
+class Compressor():
+    """
+        Streaming compressor - `compress` returns whatever compressed output is ready, `flush` the rest
+    """
+
+    def __init__(self, compression: str, level: Optional[int] = None):
+        if compression == "gzip":
+            self.compressor = zlib.compressobj(level if level is not None else 6, zlib.DEFLATED, 31)  # wbits=31: gzip header and trailer
+        elif compression == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=level if level is not None else 3).compressobj()
+        else:
+            self.compressor = None
+
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) if self.compressor is not None else data
+
+
+    def flush(self) -> bytes:
+        return self.compressor.flush() if self.compressor is not None else b""
+
+
+def create_encoder(file_format: str):
+    if file_format == "csv":
+        return CsvEncoder(EXPORT_COLUMNS)
+    return ArrowEncoder(EXPORT_COLUMNS, file_format)
+
+
+def export_headers(file_format: str, compression: str) -> dict:
+    content_type, extension = FORMATS[file_format]
+    compressed_type, compressed_extension = COMPRESSIONS[compression]
+    filename = f"users.{extension}" + (f".{compressed_extension}" if compressed_extension else "")
+    return {
+        "Content-Type": compressed_type or content_type,
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
@@ -1,23 +1,276 @@
 import os
-from typing import Optional
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
-from Backend.app.utils.logger import logger
+import json
+import time
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, Optional, Union
+from concurrent.futures import ThreadPoolExecutor  # Runs several (network-bound) secret lookups at the same time
+from Backend.app.utils.logger import get_logger
 
+logger = get_logger(__name__)
 
-def get_vault_secret(key: str) -> Optional[str]:
+
+VAULT_URL = os.getenv("VAULT_URL", r"https://{...}.vault.azure.net/")
+
+
+class SecretBackend(ABC):
     """
-        Fetching the database credentials from an Azure Key Vault
+        A source of secret values
     """
 
-    VAULT_URL = r"https://{...}.vault.azure.net/"
-    credential = DefaultAzureCredential()
+    name = "base"
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+
+class KeyVaultBackend(SecretBackend):
+    """
+        Reading secrets from an Azure Key Vault
+    """
+
+    name = "keyvault"
+
+    def __init__(self, vault_url: str = VAULT_URL):
+        # Imported here, so the local backends can be used without the Azure SDK
+        from azure.identity import DefaultAzureCredential
+        from azure.keyvault.secrets import SecretClient
+
+        # One credential and client for all the secrets - the credential caches its access token and the client reuses its HTTP connections
+        self.client = SecretClient(vault_url=vault_url, credential=DefaultAzureCredential())
+
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get_secret(key).value
+
+
+class EnvBackend(SecretBackend):
+    """
+        Reading secrets from environment variables - local stand-in for the Key Vault
+
+        "DB-SERVER" is read from `DB-SERVER`, `DB_SERVER` or `db_server`.
+    """
+
+    name = "env"
+
+    def get(self, key: str) -> Optional[str]:
+        for name in (key, key.replace("-", "_").upper(), key.replace("-", "_").lower()):
+            value = os.getenv(name)
+            if value is not None:
+                return value
+        return None
+
+
+class FileBackend(SecretBackend):
+    """
+        Reading secrets from a JSON file of {"KEY": "value"} - local stand-in for the Key Vault
+    """
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+
+
+    def get(self, key: str) -> Optional[str]:
+        with open(self.path) as file:  # Read on every call, so edits to the file are picked up by the next fetch
+            return json.load(file).get(key)
+
+
+class SecretProvider():
+    """
+        Loading secrets through a backend and keeping them in memory for `ttl` seconds
+
+        Several secrets are fetched at the same time with `get_many`, and a background thread fetches cached secrets again
+        `refresh_margin` seconds before they expire, so callers are not held up by the backend after the first load.
+        Consumers read the secrets through the provider whenever they need them (e.g. the database password on each new connection,
+        see `DBConfig.use_current_password`), so a rotated secret is picked up within `ttl` seconds without a restart.
+        A secret which cannot be fetched falls back to the environment variable of the same name (or, if it was fetched before,
+        keeps its cached value) and is tried again after `retry_delay` seconds, doubling with each failure in a row (up to `ttl`).
+        The backend can be given as a function which creates it, in which case it is only created when the first secret is read.
+    """
+
+    def __init__(self, backend: Union[SecretBackend, Callable[[], SecretBackend]], ttl: float = 3600, refresh_margin: float = 300,
+                 retry_delay: float = 5, max_workers: int = 8):
+        self._backend = backend if isinstance(backend, SecretBackend) else None
+        self.backend_factory = None if isinstance(backend, SecretBackend) else backend
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl / 2)
+        self.retry_delay = retry_delay
+        self.max_workers = max_workers
+        self.cache: Dict[str, tuple] = {}  # key -> (value, expiry time, time of the next background fetch)
+        self.timings: Dict[str, float] = {}  # key -> seconds taken by the last fetch
+        self.failures: Dict[str, int] = {}  # key -> failed fetches in a row
+        self.lock = threading.Lock()
+        self.refresher: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+
+
+    @property
+    def backend(self) -> SecretBackend:
+        if self._backend is None:
+            with self.lock:
+                if self._backend is None:
+                    self._backend = self.backend_factory()
+        return self._backend
+
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key])[key]
 
-    try:
-        client = SecretClient(vault_url=VAULT_URL, credential=credential)
-        retrieved_secret = client.get_secret(key)
-        return retrieved_secret.value
 
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+            Reading several secrets, fetching the ones which are not cached in parallel
+        """
+
+        keys = list(keys)
+        now = time.monotonic()
+        with self.lock:
+            values = {key: self.cache[key][0] for key in keys if key in self.cache and self.cache[key][1] > now}
+
+        missing = [key for key in keys if key not in values]
+        if missing:
+            start = time.perf_counter()
+            values.update(self._fetch_all(missing))
+            logger.info(f"Loaded {len(missing)} secret(s) from '{self.backend.name}' in {time.perf_counter() - start:.3f}s")
+        self.start_refresh()
+
+        return {key: values[key] for key in keys}
+
+
+    def _fetch_all(self, keys, keep_on_error: bool = False) -> Dict[str, Optional[str]]:
+        if len(keys) == 1:
+            return {keys[0]: self._fetch(keys[0], keep_on_error)}
+
+        with ThreadPoolExecutor(max_workers=min(len(keys), self.max_workers)) as executor:
+            return dict(zip(keys, executor.map(lambda key: self._fetch(key, keep_on_error), keys)))
+
+
+    def _fetch(self, key: str, keep_on_error: bool = False) -> Optional[str]:
+        start = time.perf_counter()
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            with self.lock:
+                failures = self.failures[key] = self.failures.get(key, 0) + 1
+                cached = self.cache.get(key)
+            retry = min(self.retry_delay * 2 ** (failures - 1), self.ttl)  # Backing off, so an unreachable backend is not asked again on every read
+            if keep_on_error and cached is not None:
+                value, source = cached[0], "keeping the cached value"  # Still the right value unless it has just been rotated
+            else:
+                value, source = os.getenv(key.upper()), "using the environment instead"
+            # Only the first failure in a row is an error - the repeats are warnings, which the rate limit of the log handler thins out
+            log = logger.error if failures == 1 else logger.warning
+            log(f"Secret '{key}' could not be fetched ({failures} failure(s) in a row, next try in {retry:g}s), {source}. Error: {e}")
+            expiry = refresh_at = time.monotonic() + retry  # The retry is due when the entry expires, not `refresh_margin` before
+        else:
+            with self.lock:
+                if self.failures.pop(key, None):
+                    logger.info(f"Secret '{key}' fetched again after failures")
+            expiry = time.monotonic() + self.ttl
+            refresh_at = expiry - self.refresh_margin
+        finally:
+            elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.cache[key] = (value, expiry, refresh_at)
+            self.timings[key] = elapsed
+
+        return value
+
+
+    def start_refresh(self):
+        """
+            Starting the background refresh thread (if it is not running yet - e.g. after a fork, which does not copy it)
+        """
+
+        with self.lock:
+            if self.ttl <= 0 or (self.refresher is not None and self.refresher.is_alive()):
+                return
+            self.stop_event.clear()
+            self.refresher = threading.Thread(target=self._refresh_loop, name="secret-refresh", daemon=True)
+            self.refresher.start()
+
+
+    def stop_refresh(self):
+        self.stop_event.set()
+
+
+    def _refresh_loop(self):
+        while not self.stop_event.is_set():
+            with self.lock:
+                next_refresh = min((refresh_at for _, _, refresh_at in self.cache.values()), default=None)
+
+            # Sleep until the first secret is due (or for a while if nothing is cached)
+            wait = self.ttl if next_refresh is None else max(next_refresh - time.monotonic(), 0.1)
+            if self.stop_event.wait(wait):
+                break
+
+            now = time.monotonic()
+            with self.lock:
+                due = [key for key, (_, _, refresh_at) in self.cache.items() if refresh_at <= now]
+            if due:
+                self._fetch_all(due, keep_on_error=True)
+                logger.debug(f"Refreshed {len(due)} secret(s)")
+
+
+    def reset_after_fork(self):
+        # In a forked worker the parent's refresh thread does not exist (the next read starts one) and its lock may have been held
+        self.lock = threading.Lock()
+        self.refresher = None
+
+
+    def report(self) -> dict:
+        """
+            How long each secret took to load (never the values themselves)
+        """
+
+        with self.lock:
+            timings = dict(self.timings)
+            failures = dict(self.failures)
+        return {
+            "backend": self._backend.name if self._backend is not None else None,  # None until the first secret is read
+            "ttl_seconds": self.ttl,
+            "refresh_margin_seconds": self.refresh_margin,
+            "fetch_seconds": {key: round(seconds, 6) for key, seconds in timings.items()},
+            "failing": failures,  # Secrets whose last fetches failed, and how many times in a row
+        }
+
+
+def create_secret_backend() -> SecretBackend:
+    """
+        Creating the backend selected by `SECRETS_BACKEND` ("keyvault" by default, "env" or "file")
+    """
+
+    backend = os.getenv("SECRETS_BACKEND", "keyvault").lower()
+    if backend == "env":
+        return EnvBackend()
+    if backend == "file":
+        return FileBackend(os.getenv("SECRETS_FILE", "secrets.json"))
+
+    try:
+        return KeyVaultBackend()
     except Exception as e:
-        logger.error(f"Connection to SecretClient could not be established. Error: {e}")
-        return os.getenv(key.upper())
\ No newline at end of file
+        logger.error(f"Key Vault client could not be created, reading secrets from the environment instead. Error: {e}")
+        return EnvBackend()
+
+
+secret_provider = SecretProvider(
+    create_secret_backend,  # Created when the first secret is read (the Key Vault client is not needed to import the app)
+    ttl=float(os.getenv("SECRETS_TTL", "3600")),
+    refresh_margin=float(os.getenv("SECRETS_REFRESH_MARGIN", "300")),
+    retry_delay=float(os.getenv("SECRETS_RETRY_DELAY", "5")),
+)
+
+if hasattr(os, "register_at_fork"):  # Not on Windows, where processes are never forked
+    os.register_at_fork(after_in_child=secret_provider.reset_after_fork)
+
+
+def get_vault_secret(key: str) -> Optional[str]:
+    """
+        Fetching the database credentials from an Azure Key Vault
+    """
+
+    return secret_provider.get(key)
@@ -1,15 +1,226 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
+from logging.handlers import QueueHandler  # A handler which only puts the records in a queue - the actual writing is done by a listener thread
+from Backend.app.utils.settings import parse_mapping
+
+
+# Default levels of chatty third-party loggers (`LOG_LEVELS` overrides them)
+DEFAULT_LOG_LEVELS = {"aiosqlite": "INFO", "azure": "WARNING", "urllib3": "INFO", "httpcore": "INFO"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+        Formatting each record as one JSON object per line
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+        Letting through at most `burst` warnings per `period` seconds from the same line of code
+
+        Meant for warnings on the request path (e.g. "No data found"); records of other levels are never limited.
+        The first record let through after some were dropped says how many were suppressed.
+    """
+
+    def __init__(self, burst: int = 10, period: float = 60):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.windows = {}  # (file, line) -> [window start, records in window, suppressed]
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.WARNING:
+            return True
+
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.setdefault((record.pathname, record.lineno), [now, 0, 0])
+            if now - window[0] >= self.period:
+                window[0], window[1] = now, 0
+            window[1] += 1
+
+            if window[1] > self.burst:
+                window[2] += 1
+                self.suppressed += 1
+                return False
+
+            dropped, window[2] = window[2], 0
+
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+        Putting records in a bounded queue without ever waiting - if the queue is full, the record is dropped and counted
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the message is resolved here (the arguments may change after the call) - formatting is left to the listener thread
+        record = copy.copy(record)  # Other handlers may still need the original
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = message
+        record.args = None
+        record.exc_info = None  # Tracebacks hold references to frames and cannot be passed between threads safely
+        return record
+
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingQueueListener():
+    """
+        Background thread which takes records off the queue and writes them in batches
+
+        After the first record arrives, it keeps collecting for up to `flush_interval` seconds (or `batch_size` records) and then writes them with a single call.
+    """
+
+    _sentinel = None
+
+    def __init__(self, log_queue: queue.Queue, stream, formatter: logging.Formatter, batch_size: int = 100, flush_interval: float = 0.2):
+        self.queue = log_queue
+        self.stream = stream
+        self.formatter = formatter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stop_registered = False
+
+
+    def start(self):
+        """
+            Starting the thread - called by the app's startup hook (in each worker process) and by the command-line entry points.
+            Until then, records wait in the queue.
+        """
+
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return  # Already running
+            self.thread = threading.Thread(target=self._run, name="log-listener", daemon=True)
+            self.thread.start()
+            if not self.stop_registered:
+                atexit.register(self.stop)  # Write out what is still queued when the process exits
+                self.stop_registered = True
+
+
+    def stop(self):
+        """
+            Writing out the queued records and stopping the thread
+        """
+
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            try:
+                self.queue.put(self._sentinel, timeout=5)
+            except queue.Full:
+                return
+            thread.join(timeout=5)
+
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not self._sentinel:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [record for record in batch if record is not self._sentinel]
+            if records:
+                self._write(records)
+            if len(records) < len(batch):
+                return
+
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                lines.append(f"Unable to format log record from {record.name}: {record.msg!r}")
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        except Exception:
+            pass  # Nowhere left to report it
+
 
 def create_logger():
     logger = logging.getLogger()  # Root logger instance
-    log_format = logging.Formatter("%(asctime)-15s %(levelname)-2s %(message)s")  # Setting log format (timestamp, level, message)
-    sh = logging.StreamHandler()  # Directing log messages to the console
-    sh.setFormatter(log_format)  # Setting formatter to the handler (to display messages in the above form)
-    logger.addHandler(sh)  # Adding stream handler to the root logger (i.e. logger will send messages to the handler which will in turn print to the console)
-    logger.setLevel(logging.DEBUG)  # Setting logging level of root logger.
+
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        log_format = JsonFormatter()  # One JSON object per line, for log collectors
+    else:
+        log_format = logging.Formatter("%(asctime)-15s %(levelname)-2s %(message)s")  # Setting log format (timestamp, level, message)
+
+    # Log calls only put the record in a queue (they never wait for the console); a listener thread writes them out
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(burst=int(os.getenv("LOG_RATE_LIMIT_BURST", "10")), period=float(os.getenv("LOG_RATE_LIMIT_PERIOD", "60"))))
+    handler.listener = BatchingQueueListener(log_queue, sys.stderr, log_format)  # Directing log messages to the console
+    logger.addHandler(handler)  # Adding the queue handler to the root logger
+
+    logger.setLevel(os.getenv("LOG_LEVEL", "DEBUG").upper())  # Setting logging level of root logger.
     # Setting it to 'DEBUG' will capture all levels of log messages (i.e. 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL').
     # However, setting it to for example 'INFO', it will log messages of 'INFO' level and and higher severity messages ('WARNING', 'ERROR', 'CRITICAL') but not lower severity ('DEBUG')
 
-    return logger
+    # Per-module levels, e.g. LOG_LEVELS="sqlalchemy.engine=INFO,Backend.app.routes=WARNING"
+    for name, level in {**DEFAULT_LOG_LEVELS, **parse_mapping(os.getenv("LOG_LEVELS", ""))}.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    return logger, handler
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+        The logger of a module - `logger = get_logger(__name__)` - so its level can be set on its own with LOG_LEVELS
+        (e.g. "Backend.app.routes=WARNING"). Its records go through the handler of the root logger set up here.
+    """
+
+    return logging.getLogger(name)
 
-logger = create_logger()
\ No newline at end of file
+logger, handler = create_logger()
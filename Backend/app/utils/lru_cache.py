@@ -0,0 +1,61 @@
+import time
+import threading
+from collections import OrderedDict  # A dict which remembers insertion order - used to find the least recently used entry
+from typing import Any, Callable, Optional
+
+
+class LRUCache():
+    """
+        A thread-safe, size-limited LRU cache whose entries expire at a given time
+
+        `clock` is the time function the expiry times are measured with - `time.monotonic` for lifetimes in seconds,
+        `time.time` for Unix timestamps (e.g. a token's `exp` claim).
+    """
+
+    def __init__(self, max_size: int, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expiry time)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= self.clock():
+                if entry is not None:
+                    del self.entries[key]  # Expired
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)  # Mark as most recently used
+            self.hits += 1
+            return entry[0]
+
+
+    def put(self, key: str, value: Any, expires_at: float):
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)  # Drop the least recently used entry
+                self.evictions += 1
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
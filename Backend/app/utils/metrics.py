@@ -0,0 +1,297 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))  # Queries taking at least this long are logged with their SQL and parameters
+
+slow_query_logger = logging.getLogger("Backend.app.db.slow_query")
+
+
+class Histogram():
+    """
+        Counts of observed values per bucket (Prometheus style), plus their sum
+    """
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+
+    def quantile(self, q: float) -> float:
+        """
+            Estimating a quantile (e.g. 0.99 for p99) by interpolating inside the bucket which contains it
+        """
+
+        with self.lock:
+            counts, total = list(self.counts), self.count
+        if total == 0:
+            return 0.0
+
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]  # Beyond the largest bucket, the best estimate is its bound
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+    def cumulative(self) -> Tuple[list, float, int]:
+        with self.lock:
+            counts, total_sum, total = list(self.counts), self.sum, self.count
+        running, cumulative = 0, []
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total_sum, total
+
+
+class HistogramFamily():
+    """
+        One histogram per combination of label values
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...], buckets: Iterable[float] = LATENCY_BUCKETS, quantiles: Tuple[float, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self.quantiles = quantiles
+        self.children: Dict[tuple, Histogram] = {}
+        self.lock = threading.Lock()
+
+
+    def labels(self, *values) -> Histogram:
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, Histogram(self.buckets))
+        return child
+
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            children = sorted(self.children.items())  # A copy, as `labels` may add a child while this runs
+        for values, histogram in children:
+            labels = dict(zip(self.label_names, values))
+            cumulative, total_sum, total = histogram.cumulative()
+            for bound, count in zip([*self.buckets, "+Inf"], cumulative):
+                lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total_sum}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {total}")
+
+        if self.quantiles:
+            # Estimated percentiles (p50/p95/p99) as a gauge, for dashboards which do not compute them from the buckets
+            name = f"{self.name}_quantile"
+            lines += [f"# HELP {name} Estimated quantiles of {self.name}", f"# TYPE {name} gauge"]
+            for values, histogram in children:
+                labels = dict(zip(self.label_names, values))
+                for q in self.quantiles:
+                    lines.append(f"{name}{format_labels({**labels, 'quantile': q})} {histogram.quantile(q):.6f}")
+        return lines
+
+
+class CounterFamily():
+    """
+        One counter per combination of label values
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+
+    def inc(self, values: tuple, amount: float = 1):
+        with self.lock:
+            self.values[values] = self.values.get(values, 0) + amount
+
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for values, value in items:
+            lines.append(f"{self.name}{format_labels(dict(zip(self.label_names, values)))} {value}")
+        return lines
+
+
+class Gauge():
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self.lock = threading.Lock()
+
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+
+    def render(self) -> list:
+        return render_gauge(self.name, self.documentation, {(): self.value})
+
+
+class QueryCounter():
+    """
+        Number of database queries run for the current request
+    """
+
+    def __init__(self):
+        self.count = 0
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{escape_label(value)}"' for key, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_gauge(name: str, documentation: str, samples: Dict[tuple, float], label_names: Tuple[str, ...] = (), metric_type: str = "gauge") -> list:
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for values, value in samples.items():
+        lines.append(f"{name}{format_labels(dict(zip(label_names, values)))} {value}")
+    return lines
+
+
+def render_counter(name: str, documentation: str, samples: Dict[tuple, float], label_names: Tuple[str, ...] = ()) -> list:
+    # For totals kept elsewhere (e.g. the pool and cache statistics) which only ever go up - Prometheus then knows to use rate() on them
+    return render_gauge(name, documentation, samples, label_names, metric_type="counter")
+
+
+# HTTP metrics (recorded by `MetricsMiddleware`)
+HTTP_REQUEST_DURATION = HistogramFamily("http_request_duration_seconds", "Request latency per route", ("method", "route"), quantiles=(0.5, 0.95, 0.99))
+HTTP_REQUESTS = CounterFamily("http_requests_total", "Requests per route and status code", ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being processed")
+
+# Database metrics (recorded by the engine event hooks)
+DB_QUERY_DURATION = HistogramFamily("db_query_duration_seconds", "Statement execution time", ("operation",), quantiles=(0.5, 0.95, 0.99))
+DB_ROWS = CounterFamily("db_rows_total", "Rows affected, as reported by the driver", ("operation",))
+DB_QUERIES_PER_REQUEST = HistogramFamily("db_queries_per_request", "Statements executed per request", (), buckets=COUNT_BUCKETS)
+DB_SLOW_QUERIES = CounterFamily("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", ("operation",))
+
+# Write-behind queue metrics (recorded by `utils/write_behind.py`)
+WRITE_BEHIND_BATCH_SIZE = HistogramFamily("write_behind_batch_size", "User mutations written per flush", (), buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+WRITE_BEHIND_FLUSH_DURATION = HistogramFamily("write_behind_flush_duration_seconds", "Time to write one batch of user mutations", (), quantiles=(0.5, 0.99))
+WRITE_BEHIND_MUTATIONS = CounterFamily("write_behind_mutations_total", "User mutations by outcome (queued, merged into a pending one, written, failed, requeued after a failed flush)", ("outcome",))
+
+# The counter of the request being handled - a context variable, so concurrent requests each see their own
+request_queries: contextvars.ContextVar[Optional[QueryCounter]] = contextvars.ContextVar("request_queries", default=None)
+
+
+class MetricsMiddleware():
+    """
+        ASGI middleware recording the latency, status code and number of database queries of every request
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500  # Reported if the app fails before starting a response
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        queries = QueryCounter()
+        token = request_queries.set(queries)
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            request_queries.reset(token)
+
+            # The route template (e.g. "/api/users/user") rather than the path, so every URL of a route shares one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_DURATION.labels(scope["method"], route).observe(elapsed)
+            HTTP_REQUESTS.inc((scope["method"], route, str(status)))
+            DB_QUERIES_PER_REQUEST.labels().observe(queries.count)
+
+
+def statement_operation(statement: str) -> str:
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return operation if operation in ("SELECT", "INSERT", "UPDATE", "DELETE", "MERGE") else "OTHER"
+
+
+def install_db_metrics(engine: Engine):
+    """
+        Adding the timing hooks to an engine (for an `AsyncEngine`, pass its `sync_engine`)
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - getattr(context, "_query_start", time.perf_counter())
+        operation = statement_operation(statement)
+        DB_QUERY_DURATION.labels(operation).observe(elapsed)
+
+        rowcount = getattr(cursor, "rowcount", -1)
+        if rowcount is not None and rowcount >= 0:  # Most drivers report -1 for SELECT, as the rows have not been fetched yet
+            DB_ROWS.inc((operation,), rowcount)
+
+        queries = request_queries.get()
+        if queries is not None:
+            queries.count += 1
+
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            DB_SLOW_QUERIES.inc((operation,))
+            parameters_text = repr(parameters)
+            if len(parameters_text) > 1000:
+                parameters_text = parameters_text[:1000] + "..."  # Bulk statements can have thousands of parameter sets
+            slow_query_logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {statement} | parameters: {parameters_text}")
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in (HTTP_REQUEST_DURATION, HTTP_REQUESTS, HTTP_IN_FLIGHT, DB_QUERY_DURATION, DB_ROWS, DB_QUERIES_PER_REQUEST, DB_SLOW_QUERIES,
+                   WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_DURATION, WRITE_BEHIND_MUTATIONS):
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,36 @@
+import json
+import base64
+from typing import Any, Tuple
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+        Creating an opaque continuation token from the sort key of the last row on a page
+    """
+
+    payload = json.dumps(values, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")  # URL-safe, so it can be passed as a query parameter as-is
+
+
+def decode_cursor(cursor: str, *types: type) -> Tuple[Any, ...]:
+    """
+        Reading the sort key back from a continuation token
+
+        Raises a `ValueError` if the token was not created by `encode_cursor` with one value of each of `types`
+        (e.g. `decode_cursor(cursor, int, int)` for an (age, id) key).
+    """
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)  # Restoring the padding stripped in `encode_cursor`
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    # The values end up as query parameters, so a token edited by the client (e.g. strings instead of numbers) is rejected here
+    # rather than failing the conversion in the database. `bool` is excluded, as JSON `true` would otherwise pass for an int
+    if any(isinstance(value, bool) or not isinstance(value, expected) for value, expected in zip(values, types)):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+    return tuple(values)
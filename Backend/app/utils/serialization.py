@@ -0,0 +1,29 @@
+import json
+from datetime import date, datetime
+from typing import Any
+
+try:
+    import orjson  # Fast JSON encoder written in Rust - optional, the standard library is used without it
+except ImportError:
+    orjson = None
+
+
+JSON_ENCODER = "orjson" if orjson is not None else "json"
+
+
+def _default(value: Any):
+    # Dates as ISO 8601 strings, with "Z" for UTC like pydantic (and orjson with OPT_UTC_Z) writes them
+    if isinstance(value, (date, datetime)):
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """
+        Encoding plain data (dicts, lists, strings, numbers, dates) as compact JSON bytes
+    """
+
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+    return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
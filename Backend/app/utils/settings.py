@@ -0,0 +1,13 @@
+from typing import Dict
+
+
+def parse_mapping(setting: str) -> Dict[str, str]:
+    """
+        Reading an environment setting of the form "name=value,other.name=value" into a dictionary (names and values stripped)
+    """
+
+    mapping = {}
+    for item in filter(None, (part.strip() for part in setting.split(","))):
+        name, _, value = item.partition("=")
+        mapping[name.strip()] = value.strip()
+    return mapping
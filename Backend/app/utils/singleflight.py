@@ -0,0 +1,95 @@
+import os
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class Flight():
+    """
+        One call in progress, shared by the callers which asked for the same key
+    """
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.started = time.monotonic()
+        self.followers = 0
+
+
+class SingleFlight():
+    """
+        Coalescing identical concurrent calls: while a call for a key is running, other callers with the same key wait for
+        its result instead of making the call again
+
+        Unlike a cache, nothing is kept once the call has finished, so no result is older than the request which asked for it
+        by more than `window` seconds: a caller only joins a call started at most that long ago, otherwise it starts a new one.
+        A caller waiting longer than `timeout` seconds gives up on the shared call and makes its own.
+        For keys made with `QueryCache.make_key`, invalidating the namespace also changes the key, so callers arriving after
+        a write never join a call started before it.
+    """
+
+    def __init__(self, window: float = 1.0, timeout: float = 10.0, enabled: bool = True):
+        self.window = window
+        self.timeout = timeout
+        self.enabled = enabled
+        self.flights: Dict[str, Flight] = {}
+        self.calls = 0  # Calls made
+        self.joined = 0  # Callers who waited for another caller's call
+        self.timeouts = 0  # ... of which gave up and made their own call
+        self.errors = 0  # Calls which failed (all of their callers got the error)
+
+
+    async def do(self, key: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+            The result of `await fn(*args, **kwargs)`, shared with the other callers of `key` in the meantime
+        """
+
+        if not self.enabled:
+            return await fn(*args, **kwargs)
+
+        flight = self.flights.get(key)
+        if flight is not None and not flight.task.done() and time.monotonic() - flight.started <= self.window \
+                and flight.task.get_loop() is asyncio.get_running_loop():
+            flight.followers += 1
+            self.joined += 1
+            try:
+                # `shield`: a follower giving up (timeout, or its request being cancelled) does not cancel the call for the others
+                return await asyncio.wait_for(asyncio.shield(flight.task), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return await fn(*args, **kwargs)
+
+        # The call runs as its own task, so it finishes (for the followers) even if the caller who started it is cancelled
+        task = asyncio.ensure_future(fn(*args, **kwargs))
+        flight = self.flights[key] = Flight(task)
+        self.calls += 1
+        task.add_done_callback(lambda _: self._finished(key, flight))
+        return await asyncio.shield(task)
+
+
+    def _finished(self, key: str, flight: Flight):
+        if self.flights.get(key) is flight:  # Not replaced by a newer call after the window had passed
+            del self.flights[key]
+        if not flight.task.cancelled() and flight.task.exception() is not None:  # Also marks the exception as retrieved, if nobody was left waiting
+            self.errors += 1
+
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "window_seconds": self.window,
+            "timeout_seconds": self.timeout,
+            "calls": self.calls,
+            "joined": self.joined,
+            "timeouts": self.timeouts,
+            "calls_avoided": self.joined - self.timeouts,
+            "errors": self.errors,
+            "in_flight": len(self.flights),
+        }
+
+
+# Shared by the user read routes (one per worker process, like the query cache)
+singleflight = SingleFlight(
+    window=float(os.getenv("SINGLEFLIGHT_WINDOW", "1.0")),
+    timeout=float(os.getenv("SINGLEFLIGHT_TIMEOUT", "10")),
+    enabled=os.getenv("SINGLEFLIGHT", "true").lower() == "true",
+)
@@ -0,0 +1,47 @@
+import time
+import hashlib
+from typing import Any, Optional
+from Backend.app.utils.lru_cache import LRUCache
+
+
+class TokenCache(LRUCache):
+    """
+        A size-limited LRU cache of verified access tokens
+
+        Entries are keyed by a hash of the token (the token itself is not kept as a key) and expire at the token's `exp` claim or after `max_ttl` seconds, whichever comes first.
+    """
+
+    def __init__(self, max_size: int = 10000, max_ttl: float = 3600):
+        super().__init__(max_size, clock=time.time)  # Expiry times are Unix times, like `exp`
+        self.max_ttl = max_ttl
+        self.invalidations = 0
+
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+
+    def set(self, key: str, value: Any, expires_at: Optional[float]):
+        """
+            Caching `value` until the Unix time `expires_at` (the token's `exp`)
+        """
+
+        expiry = time.time() + self.max_ttl
+        if expires_at is not None:
+            expiry = min(expiry, float(expires_at))
+        if expiry <= time.time():
+            return
+        self.put(key, value, expiry)
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["invalidations"] = self.invalidations
+        return stats
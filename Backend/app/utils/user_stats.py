@@ -0,0 +1,221 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from Backend.app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))  # Worker processes serving the app (set by `main.py` for the workers it starts)
+# Seconds between full recounts from the database, 0 to disable them - more often with several workers, as each one only sees its own writes (see `UserStats`)
+RECONCILE_INTERVAL = float(os.getenv("USER_STATS_RECONCILE_INTERVAL", "300" if WORKERS <= 1 else "30"))
+STALE_DELAY = float(os.getenv("USER_STATS_STALE_DELAY", "5"))  # Seconds after a write with an unknown effect (e.g. an age change without the old age) until the recount
+
+PENDING = "user_stats_pending"  # `session.info` key of the changes waiting for the session's commit
+
+
+class AgeHistogram():
+    """
+        Number of users per age
+
+        Ages are whole years, so there are only ~100 buckets: "how many are older than X", min/max/mean and percentiles
+        are answered by walking the buckets instead of scanning the table.
+    """
+
+    def __init__(self, counts: Optional[Dict[int, int]] = None):
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.age_sum = 0
+        for age, count in (counts or {}).items():
+            self.add(age, count)
+
+
+    def add(self, age: int, count: int = 1):
+        if age is None or count == 0:
+            return
+        remaining = self.counts.get(age, 0) + count
+        if remaining > 0:
+            self.counts[age] = remaining
+        else:
+            self.counts.pop(age, None)
+        self.total += count
+        self.age_sum += age * count
+
+
+    def count_older_than(self, age: int) -> int:
+        return sum(count for bucket, count in self.counts.items() if bucket > age)
+
+
+    def percentile(self, q: float) -> Optional[int]:
+        """
+            The age at percentile `q` (0-100), nearest-rank method - i.e. the smallest age with at least q% of the users at or below it
+        """
+
+        if self.total <= 0:
+            return None
+        rank = max(1, -(-q * self.total // 100))  # Ceiling of q% of the users
+        seen = 0
+        for age in sorted(self.counts):
+            seen += self.counts[age]
+            if seen >= rank:
+                return age
+        return max(self.counts)
+
+
+    def summary(self) -> dict:
+        return {
+            "total": self.total,
+            "min": min(self.counts) if self.counts else None,
+            "max": max(self.counts) if self.counts else None,
+            "mean": round(self.age_sum / self.total, 3) if self.total > 0 else None,
+        }
+
+
+class UserStats():
+    """
+        The age histogram of the users table, kept up to date without querying it
+
+        It is built from one `GROUP BY age` query (`reconcile`). After that, the write paths report the ages they add and remove
+        (`record`). The changes wait in the session until it commits, so nothing from a rolled-back transaction is counted.
+        A full recount runs every `reconcile_interval` seconds to correct any drift (e.g. writes made outside this app), and sooner
+        after a write whose effect is not known (`record_unknown`).
+
+        The histogram is per process: with several workers, a write handled by one worker is only seen by the others at their
+        next recount, so their answers can lag by up to `reconcile_interval` seconds and differ from worker to worker.
+        `snapshot` says so (`max_lag_seconds`) rather than presenting the numbers as current.
+    """
+
+    def __init__(self, reconcile_interval: float = RECONCILE_INTERVAL, stale_delay: float = STALE_DELAY, workers: int = WORKERS):
+        self.reconcile_interval = reconcile_interval
+        self.workers = workers
+        self.stale_delay = stale_delay
+        self.histogram = AgeHistogram()
+        self.loaded = False
+        self.stale_since: Optional[float] = None
+        self.last_reconciled: Optional[float] = None  # time.time() of the last recount
+        self.last_drift = 0  # Users counted incrementally but not found by the last recount (or the reverse, if negative)
+        self.lock = threading.Lock()
+
+
+    def record(self, session: Session, added: Iterable[int] = (), removed: Iterable[int] = ()):
+        """
+            Noting the ages of users inserted/deleted (an age change is one of each) - applied when the session commits
+        """
+
+        pending = session.info.setdefault(PENDING, [])
+        pending.extend((age, 1) for age in added if age is not None)
+        pending.extend((age, -1) for age in removed if age is not None)
+
+
+    def record_unknown(self, session: Session):
+        # A write which may have changed ages without telling which ones - the histogram is recounted shortly after the commit
+        session.info.setdefault(PENDING, []).append(None)
+
+
+    def apply(self, changes: List[Optional[Tuple[int, int]]]):
+        with self.lock:
+            for change in changes:
+                if change is None:
+                    self.stale_since = self.stale_since or time.monotonic()
+                else:
+                    self.histogram.add(*change)
+
+
+    def reconcile(self, counts: Iterable[Tuple[int, int]]):
+        """
+            Replacing the histogram with counts from the database
+
+            Writes committed while the recount query ran may be counted twice or not at all; the next recount corrects that.
+        """
+
+        histogram = AgeHistogram({age: count for age, count in counts if age is not None})
+        with self.lock:
+            drift = self.histogram.total - histogram.total if self.loaded else 0
+            self.histogram = histogram
+            self.loaded = True
+            self.stale_since = None
+            self.last_reconciled = time.time()
+            self.last_drift = drift
+        if drift:
+            logger.info(f"User stats recount corrected a drift of {drift} users")
+
+
+    def needs_reconcile(self) -> bool:
+        with self.lock:
+            if not self.loaded:
+                return True
+            if self.stale_since is not None and time.monotonic() - self.stale_since >= self.stale_delay:
+                return True
+            return self.reconcile_interval > 0 and time.time() - self.last_reconciled >= self.reconcile_interval
+
+
+    def snapshot(self, older_than: Iterable[int] = (), percentiles: Iterable[float] = (), include_buckets: bool = False) -> dict:
+        with self.lock:
+            histogram = self.histogram
+            result = histogram.summary()
+            result["older_than"] = {age: histogram.count_older_than(age) for age in older_than}
+            result["percentiles"] = {f"p{q:g}": histogram.percentile(q) for q in percentiles}
+            if include_buckets:
+                result["buckets"] = dict(sorted(histogram.counts.items()))
+            result["stale"] = self.stale_since is not None
+            result["last_reconciled"] = self.last_reconciled
+            result["last_drift"] = self.last_drift
+            if self.workers > 1:
+                # Bound on how long writes handled by the other workers can be missing (unbounded without periodic recounts)
+                result["max_lag_seconds"] = self.reconcile_interval if self.reconcile_interval > 0 else None
+                result["stale"] = result["stale"] or self.reconcile_interval <= 0
+        return result
+
+
+user_stats = UserStats()
+
+
+@event.listens_for(Session, "after_commit")
+def apply_pending_changes(session: Session):
+    changes = session.info.pop(PENDING, None)
+    if changes:
+        user_stats.apply(changes)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def discard_pending_changes(session: Session, transaction):
+    # Whatever is left when the outermost transaction ends without a commit (rolled back, or the session closed) never happened
+    if transaction.parent is None:
+        session.info.pop(PENDING, None)
+
+
+async def refresh_user_stats():
+    """
+        Recounting the users per age (one GROUP BY query, on the primary so the counts are current)
+    """
+
+    # Imported here, as the repository itself imports this module to report its writes
+    from Backend.app.config.db_config import open_session
+    from Backend.app.config.db_routing import use_primary
+    from Backend.app.repositories.user import user_repository
+
+    def count_ages(session):
+        use_primary(session)
+        return user_repository.age_counts(session)
+
+    async with open_session() as session:
+        counts = await session.run_sync(count_ages)
+    user_stats.reconcile(counts)
+
+
+async def keep_user_stats_current(check_interval: float = 1.0):
+    """
+        Background task recounting the histogram whenever `needs_reconcile` says so
+    """
+
+    while True:
+        await asyncio.sleep(check_interval)
+        if user_stats.needs_reconcile():
+            try:
+                await refresh_user_stats()
+            except Exception as e:
+                logger.warning(f"User stats recount failed: {e}")
@@ -0,0 +1,369 @@
+import os
+import time
+import itertools
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+from Backend.app.utils.logger import get_logger
+from Backend.app.repositories.user import users_table
+from Backend.app.utils.user_stats import user_stats
+from Backend.app.utils.cache import query_cache, USERS
+from Backend.app.utils.metrics import WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_DURATION, WRITE_BEHIND_MUTATIONS
+from Backend.app.config.db_config import open_session
+
+logger = get_logger(__name__)
+
+
+MAX_BATCH_SIZE = 2000  # The deletes of a batch are one `id IN (...)`, and SQL Server accepts at most 2100 parameters per statement
+
+
+class QueueFullError(Exception):
+    """
+        The write-behind queue stayed full for longer than the caller was willing to wait
+    """
+
+
+def is_data_error(error: Exception) -> bool:
+    """
+        Whether a failed write was rejected because of the data itself (e.g. a duplicate email, a value too long for its column)
+
+        Only these are the fault of a submission, and retrying it would fail the same way. Anything else - a lost connection,
+        a pool timeout, a failover - says nothing about the changes, which are kept and written once the database is back.
+    """
+
+    return isinstance(error, (IntegrityError, DataError))
+
+
+def write_batch(session: Session, batch: Dict[int, Optional[dict]]) -> int:
+    """
+        Writing a batch of user mutations (user id -> fields to set, or None to delete the user) in the session's transaction
+
+        The updates which set the same fields share one executemany UPDATE, and all the deletes are one DELETE.
+        Returns the number of users changed.
+    """
+
+    changed = 0
+    updates: Dict[Tuple[str, ...], List[dict]] = {}
+    for user_id, fields in batch.items():
+        if fields:  # Not a delete (None), nor an update without any field to set
+            updates.setdefault(tuple(sorted(fields)), []).append({"user_id": user_id, **{f"new_{field}": value for field, value in fields.items()}})
+
+    for fields, rows in updates.items():
+        statement = update(users_table) \
+                        .where(users_table.c.id == bindparam("user_id")) \
+                        .values({field: bindparam(f"new_{field}") for field in fields})
+        changed += max(session.execute(statement, rows).rowcount, 0)  # Some drivers report -1 for an executemany
+        if "age" in fields:
+            user_stats.record_unknown(session)  # The previous ages are not known without reading them first
+
+    deleted_ids = [user_id for user_id, fields in batch.items() if fields is None]
+    if deleted_ids:
+        statement = delete(users_table).where(users_table.c.id.in_(deleted_ids))
+        if session.get_bind(clause=statement).dialect.delete_returning:
+            ages = session.scalars(statement.returning(users_table.c.age)).all()
+            user_stats.record(session, removed=ages)
+            changed += len(ages)
+        else:
+            changed += session.execute(statement).rowcount
+            user_stats.record_unknown(session)
+
+    return changed
+
+
+Submission = Tuple[int, Optional[dict]]  # (submission number, fields to set - or None to delete the user)
+
+
+def merge(submissions: List[Submission]) -> Optional[dict]:
+    """
+        The change a user's queued submissions add up to: a delete (None), or the fields of all the updates, later values winning
+    """
+
+    if submissions[0][1] is None:
+        return None  # A delete is always alone (see `submit`)
+    merged = {}
+    for _, fields in submissions:
+        merged.update(fields)
+    return merged
+
+
+class UserWriteBehind():
+    """
+        Queue of user updates and deletes, written to the database in batches instead of one transaction each
+
+        Pending mutations are kept per user id, so repeated updates of the same user (e.g. its `datetime`) are written as one
+        and a delete replaces the updates before it. Each submission is still kept on its own: if the merged change of a user is
+        rejected as bad data (`is_data_error`), its submissions are retried one at a time, so a bad one (e.g. a duplicate email) only drops itself.
+        Any other failure (the database cannot be reached) drops nothing: what was not written goes back into the queue, and the next
+        flush waits `retry_delay` seconds, doubling with each failure in a row up to `max_retry_delay`.
+        The queue is flushed `flush_interval` seconds after the first mutation arrives, or as soon as it holds `batch_size` users, each batch in one transaction.
+        It holds at most `max_pending` users: beyond that, `submit` waits for a flush (up to `submit_timeout` seconds, then
+        `QueueFullError`), which slows the writers down to the database's pace instead of growing without bound.
+        Queued mutations are only in this process's memory until flushed - `close` (called on shutdown) writes out what is left,
+        but a crash loses them.
+    """
+
+    def __init__(self, enabled: bool = False, batch_size: int = 500, flush_interval: float = 0.5, max_pending: int = 10000, submit_timeout: float = 5.0,
+                 retry_delay: float = 0.5, max_retry_delay: float = 30.0):
+        self.enabled = enabled
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, self.batch_size)
+        self.submit_timeout = submit_timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max(max_retry_delay, retry_delay)
+        self.pending: Dict[int, List[Submission]] = {}  # user id -> its queued changes, in the order they arrived
+        self.numbers = itertools.count(1)  # Submission numbers
+        self.task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.failed = 0
+        self.retries = 0  # Flushes which failed and left their changes queued
+        self.failures_in_a_row = 0
+        self.last_flush_seconds: Optional[float] = None
+
+
+    async def submit(self, user_id: int, fields: Optional[dict]) -> int:
+        """
+            Queueing an update (`fields`: the fields to set, None values are left unchanged) or a delete (`fields` None)
+
+            Returns the number of the submission, which the log names if the change has to be dropped.
+        """
+
+        if self.task is None:
+            self.start()
+
+        if user_id not in self.pending and len(self.pending) >= self.max_pending:
+            self.batch_ready.set()  # Flush now rather than at the next interval
+            async with self.space:
+                try:
+                    await asyncio.wait_for(self.space.wait_for(lambda: user_id in self.pending or len(self.pending) < self.max_pending), self.submit_timeout)
+                except asyncio.TimeoutError:
+                    raise QueueFullError(f"Write-behind queue full ({self.max_pending} users pending)")
+
+        number = next(self.numbers)
+        if fields is not None:
+            fields = {field: value for field, value in fields.items() if value is not None}
+        submissions = self.pending.get(user_id)
+        if submissions is None or fields is None:
+            self.pending[user_id] = [(number, fields)]  # A delete makes the pending updates of the user pointless
+        elif submissions[-1][1] is not None:
+            submissions.append((number, fields))  # Merged when written, the later value of a field winning
+        # else: the user is about to be deleted, so the update is dropped
+
+        WRITE_BEHIND_MUTATIONS.inc(("queued",) if submissions is None else ("merged",))
+        self.has_pending.set()
+        if len(self.pending) >= self.batch_size:
+            self.batch_ready.set()
+        return number
+
+
+    def start(self):
+        if self.task is None:
+            # Created here rather than in `__init__`, so they belong to the event loop serving the requests (one per worker)
+            self.has_pending = asyncio.Event()
+            self.batch_ready = asyncio.Event()  # Set when the queue holds a full batch
+            self.space = asyncio.Condition()  # Notified after a flush, for the writers waiting for room
+            self.flush_lock = asyncio.Lock()
+            self.task = asyncio.create_task(self._run())
+
+
+    async def _run(self):
+        while True:
+            await self.has_pending.wait()
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), self.flush_interval)  # A full batch is written right away
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await asyncio.shield(self.flush())  # `close` cancels this loop, which must not interrupt a batch being written
+                self.failures_in_a_row = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.retries += 1
+                self.failures_in_a_row += 1
+                delay = min(self.retry_delay * 2 ** (self.failures_in_a_row - 1), self.max_retry_delay)
+                # Only the first failure in a row is an error - the database is usually just unreachable for a moment
+                log = logger.error if self.failures_in_a_row == 1 else logger.warning
+                log(f"Write-behind flush failed ({self.failures_in_a_row} in a row), {len(self.pending)} users kept queued, next try in {delay:g}s: {e}")
+                await asyncio.sleep(delay)
+
+
+    async def flush(self):
+        """
+            Writing out everything pending, `batch_size` users per transaction
+        """
+
+        async with self.flush_lock:
+            batch_items, self.pending = list(self.pending.items()), {}
+            self.has_pending.clear()
+            self.batch_ready.clear()
+            async with self.space:
+                self.space.notify_all()  # There is room again (mutations arriving from now on wait for the next flush)
+
+            written = 0
+            try:
+                for start in range(0, len(batch_items), self.batch_size):
+                    try:
+                        written += await self._write(dict(batch_items[start:start + self.batch_size]))
+                    except Exception:
+                        self._requeue(dict(batch_items[start + self.batch_size:]))  # The batches not tried yet (`_write` requeues its own)
+                        raise
+            finally:
+                if written:
+                    query_cache.invalidate(USERS)
+
+
+    async def _write(self, batch: Dict[int, List[Submission]]) -> int:
+        start = time.perf_counter()
+        submitted = sum(len(submissions) for submissions in batch.values())
+        try:
+            async with open_session() as session:
+                changed = await session.run_sync(write_batch, {user_id: merge(submissions) for user_id, submissions in batch.items()})
+                await session.commit()
+        except Exception as e:
+            if not is_data_error(e):
+                self._requeue(batch)
+                raise
+
+            # One bad mutation (e.g. a duplicate email) would fail the whole batch, so each user is retried on its own and only the bad changes are dropped
+            logger.warning(f"Write-behind batch of {len(batch)} users failed ({e}), retrying them one by one")
+            failed_before = self.failed
+            changed = 0
+            remaining = dict(batch)  # `_write_user` removes the submissions it has written or dropped from their lists
+            try:
+                for user_id, submissions in batch.items():
+                    changed += await self._write_user(user_id, submissions)
+                    del remaining[user_id]
+            except Exception:
+                self._requeue(remaining)
+                raise
+            finally:
+                requeued = sum(len(submissions) for submissions in remaining.values())
+                WRITE_BEHIND_MUTATIONS.inc(("written",), submitted - requeued - (self.failed - failed_before))
+        else:
+            WRITE_BEHIND_MUTATIONS.inc(("written",), submitted)
+
+        elapsed = time.perf_counter() - start
+        self.batches += 1
+        self.last_flush_seconds = elapsed
+        WRITE_BEHIND_BATCH_SIZE.labels().observe(len(batch))
+        WRITE_BEHIND_FLUSH_DURATION.labels().observe(elapsed)
+        return changed
+
+
+    async def _write_user(self, user_id: int, submissions: List[Submission]) -> int:
+        """
+            Writing the changes of one user after its batch failed: merged first, then - if that is rejected too - each submission
+            in its own transaction, so a bad one (e.g. a duplicate email) does not take the others of the user with it
+
+            The submissions written or dropped are removed from `submissions`; an error other than a data error is raised with
+            the rest still in it.
+        """
+
+        try:
+            changed = await self._commit(user_id, merge(submissions))
+        except Exception as e:
+            if not is_data_error(e):
+                raise
+            if len(submissions) == 1:
+                self._dropped(user_id, submissions.pop(), e)
+                return 0
+        else:
+            submissions.clear()
+            return changed
+
+        changed = 0
+        while submissions:
+            try:
+                changed += await self._commit(user_id, submissions[0][1])
+            except Exception as e:
+                if not is_data_error(e):
+                    raise
+                self._dropped(user_id, submissions[0], e)
+            del submissions[0]
+        return changed
+
+
+    async def _commit(self, user_id: int, fields: Optional[dict]) -> int:
+        async with open_session() as session:
+            changed = await session.run_sync(write_batch, {user_id: fields})
+            await session.commit()
+        return changed
+
+
+    def _requeue(self, batch: Dict[int, List[Submission]]):
+        """
+            Putting changes which could not be written back into the queue, before any submitted for the same users since
+        """
+
+        requeued = 0
+        for user_id, submissions in batch.items():
+            if not submissions:
+                continue
+            newer = self.pending.get(user_id)
+            if newer is None or submissions[-1][1] is None:
+                self.pending[user_id] = submissions  # A requeued delete wins over the updates submitted after it (as in `submit`)
+            elif newer[0][1] is not None:
+                self.pending[user_id] = submissions + newer
+            # else: the user has been deleted since, which makes the requeued updates pointless
+            requeued += len(submissions)
+
+        if requeued:
+            WRITE_BEHIND_MUTATIONS.inc(("requeued",), requeued)
+            self.has_pending.set()
+
+
+    def _dropped(self, user_id: int, submission: Submission, error: Exception):
+        number, fields = submission
+        self.failed += 1
+        WRITE_BEHIND_MUTATIONS.inc(("failed",))
+        change = "delete" if fields is None else f"update {fields}"
+        logger.error(f"Write-behind submission {number} ({change} of user {user_id}) dropped: {error}")
+
+
+    async def close(self):
+        """
+            Stopping the background flushes and writing out what is still queued (on shutdown)
+        """
+
+        if self.task is None:
+            return  # Nothing was ever queued
+        self.task.cancel()  # The flush it may be running is shielded, so it carries on and keeps holding `flush_lock`
+        self.task = None
+        if self.pending:
+            logger.info(f"Writing {len(self.pending)} pending user mutations before shutdown")
+        # Always called, even with nothing pending: a running flush has already taken the pending mutations, and waiting for
+        # the lock here is what keeps the caller from disposing of the engines while that batch is still being written
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Write-behind flush failed on shutdown, the pending changes of {len(self.pending)} users are lost: {e}")
+
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self.pending),
+            "max_pending": self.max_pending,
+            "batch_size": self.batch_size,
+            "flush_interval_seconds": self.flush_interval,
+            "batches": self.batches,
+            "failed": self.failed,
+            "retries": self.retries,
+            "failures_in_a_row": self.failures_in_a_row,
+            "last_flush_seconds": round(self.last_flush_seconds, 6) if self.last_flush_seconds is not None else None,
+        }
+
+
+# WRITE_BEHIND=true makes the PATCH/DELETE user routes queue their changes here instead of writing them right away
+user_write_behind = UserWriteBehind(
+    enabled=os.getenv("WRITE_BEHIND", "false").lower() == "true",
+    batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5")),
+    max_pending=int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000")),
+    submit_timeout=float(os.getenv("WRITE_BEHIND_SUBMIT_TIMEOUT", "5")),
+    retry_delay=float(os.getenv("WRITE_BEHIND_RETRY_DELAY", "0.5")),
+    max_retry_delay=float(os.getenv("WRITE_BEHIND_MAX_RETRY_DELAY", "30")),
+)
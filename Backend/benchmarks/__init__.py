@@ -0,0 +1,8 @@
+"""
+    Benchmarks of the user endpoints and of the three data-access styles of `UserRepository` (ORM, Core, raw DBAPI SQL)
+
+    Everything runs against a local SQLite stand-in for the `users` table, so no server is needed:
+
+        python -m Backend.benchmarks --rows 100000 --output results.json
+        python -m Backend.benchmarks --compare old.json new.json
+"""
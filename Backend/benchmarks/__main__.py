@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from Backend.benchmarks.seed import seed_database
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def result_key(result: dict) -> tuple:
+    return (result["suite"], result.get("style", result.get("endpoint")), result.get("operation", result.get("concurrency")))
+
+
+def compare(old_path: str, new_path: str):
+    """
+        Printing the change of every result between two runs (negative latency / positive throughput changes are improvements)
+    """
+
+    with open(old_path) as file:
+        old = {result_key(result): result for result in json.load(file)["results"]}
+    with open(new_path) as file:
+        new = json.load(file)["results"]
+
+    def change(before, after):
+        return f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+
+    print(f"{'benchmark':<36} {'throughput':>11} {'p50':>9} {'p99':>9}")
+    for result in new:
+        key = result_key(result)
+        if key in old:
+            before = old[key]
+            name = "/".join(str(part) for part in key)
+            print(f"{name:<36} {change(before['throughput_per_s'], result['throughput_per_s']):>11} {change(before['p50_ms'], result['p50_ms']):>9} {change(before['p99_ms'], result['p99_ms']):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m Backend.benchmarks", description="Benchmarks of the data-access styles and the user endpoints")
+    parser.add_argument("--rows", type=int, default=10000, help="Users to seed (e.g. 10000 to 10000000)")
+    parser.add_argument("--database", default="benchmark.db", help="SQLite file to create (it is replaced)")
+    parser.add_argument("--reuse", action="store_true", help="Use the existing database instead of seeding it again")
+    parser.add_argument("--suites", default="queries,load", help="Comma-separated: queries, load")
+    parser.add_argument("--styles", default="orm,core,dbapi", help="Data-access styles (UserRepository backends) for the queries suite")
+    parser.add_argument("--operations", default="select,insert,update,delete", help="Operations for the queries suite")
+    parser.add_argument("--iterations", type=int, default=1000, help="Calls per style and operation")
+    parser.add_argument("--requests", type=int, default=500, help="Requests sent by the load suite")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients of the load suite")
+    parser.add_argument("--query-cache", action="store_true", help="Keep the query cache enabled during the load suite")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed of the data and parameters")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    path = os.path.abspath(args.database)
+
+    if args.reuse and os.path.exists(path):
+        database_url = f"sqlite:///{path}"
+    else:
+        print(f"Seeding {args.rows} users into {path}", file=sys.stderr)
+        database_url = seed_database(path, args.rows, seed=args.seed)
+
+    # The app reads its settings when its modules are imported, and the queries suite already imports the repository
+    from Backend.benchmarks.load import prepare_environment
+    prepare_environment(database_url, query_cache=args.query_cache)
+
+    results = []
+    if "queries" in suites:
+        from Backend.benchmarks.queries import run_query_benchmarks
+        styles = [style.strip() for style in args.styles.split(",") if style.strip()]
+        operations = [operation.strip() for operation in args.operations.split(",") if operation.strip()]
+        results += run_query_benchmarks(path, args.iterations, styles, operations, seed=args.seed)
+
+    if "load" in suites:
+        from Backend.benchmarks.load import create_test_app, run_load
+        app = create_test_app()
+        results.append(asyncio.run(run_load(app, args.requests, args.concurrency, seed=args.seed)))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rows": args.rows,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    for result in results:
+        name = "/".join(str(part) for part in result_key(result))
+        print(f"{name:<36} {result['throughput_per_s']:>10.1f}/s  p50 {result['p50_ms']:>8.3f} ms  p99 {result['p99_ms']:>8.3f} ms  rss {result['peak_rss_mb']} MB")
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import time
+import random
+import asyncio
+from collections import Counter
+from Backend.benchmarks.stats import summarize
+
+
+def prepare_environment(database_url: str, query_cache: bool = False):
+    """
+        Pointing the app at the benchmark database - must be called before the app's services are first built (the engines
+        and the auth scheme read `DB_URL` and the secrets then, see `config/container.py`). The query cache TTL and the log level
+        are read when their modules are imported, so they only apply if this runs before `Backend.app` is imported
+    """
+
+    os.environ["DB_URL"] = database_url
+    os.environ.setdefault("SECRETS_BACKEND", "env")  # No Key Vault lookups
+    os.environ.setdefault("AZ_TENANT_ID", "00000000-0000-0000-0000-000000000000")  # Only needed to construct the auth scheme, which is stubbed out
+    os.environ.setdefault("AZ_APP_CLIENT_ID", "00000000-0000-0000-0000-000000000000")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")  # "No data found" warnings would otherwise be part of what is measured
+    if not query_cache:
+        os.environ["QUERY_CACHE_TTL"] = "0"  # Every request reaches the database (otherwise this mostly measures cache hits)
+
+
+def create_test_app():
+    """
+        The app with authentication replaced by a dependency which lets every request through
+    """
+
+    from Backend.app.config.app_config import app
+    from Backend.app.config.ad_config import azure_scheme
+
+    app.dependency_overrides[azure_scheme] = lambda: None
+    return app
+
+
+async def run_load(app, requests: int, concurrency: int, seed: int = 42) -> dict:
+    """
+        Sending `requests` GET /api/users/user requests from `concurrency` concurrent clients, in process (no sockets, so only the app is measured)
+    """
+
+    import httpx
+
+    rng = random.Random(seed)
+    ages = [rng.randint(18, 95) for _ in range(requests)]  # Some ages above the oldest user, so the 404 path is exercised too
+    latencies, statuses = [], Counter()
+    position = 0
+
+    async def client_loop(client):
+        nonlocal position
+        while position < len(ages):
+            age = ages[position]
+            position += 1  # No `await` between reading and incrementing, so the clients never take the same item
+            start = time.perf_counter()
+            response = await client.get("/api/users/user", params={"user_age": age})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for _ in range(min(20, requests)):  # Warm-up (pool connections, compiled statements)
+            await client.get("/api/users/user", params={"user_age": 30})
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    # Closing the pooled connections inside this event loop (aiosqlite connections run on threads which would keep the process alive)
+    from Backend.app.config.container import container
+    await container.aclose()
+
+    return {
+        "suite": "load",
+        "endpoint": "/api/users/user",
+        "concurrency": concurrency,
+        "db_mode": os.getenv("DB_MODE", "async"),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        **summarize(latencies, elapsed),
+    }
@@ -0,0 +1,112 @@
+import time
+import random
+import sqlite3
+from contextlib import closing
+from datetime import date, datetime, timezone
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from Backend.app.repositories.user import BACKENDS
+from Backend.benchmarks.stats import summarize
+
+
+# Each style is a backend of `UserRepository` - the code behind the API routes and `example_queries.py` - with its sessions bound
+# to the benchmark database instead of the configured one, so what is measured is what ships
+
+OPERATIONS = ("select", "insert", "update", "delete")
+
+BIRTHDAY = date(1992, 8, 25)
+TIMESTAMP = datetime(2024, 10, 24, 14, 30, tzinfo=timezone.utc)
+
+
+class RepositoryQueries():
+    """
+        The operations of one `UserRepository` backend ("orm", "core" or "dbapi"), each in its own transaction like `example_queries.py`
+    """
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.backend = BACKENDS[name]()
+        self.engine = create_engine(f"sqlite:///{path}")
+        self.session = sessionmaker(autocommit=False, autoflush=True, bind=self.engine)
+
+
+    def select(self, age):
+        with self.session() as session:
+            return self.backend.oldest(session, age, limit=5)
+
+
+    def insert(self, name, age, email):
+        with self.session.begin() as session:
+            self.backend.add(session, name, age, email, BIRTHDAY, TIMESTAMP)
+
+
+    def update(self, user_id, age):
+        with self.session.begin() as session:
+            self.backend.update(session, user_id, {"age": age})
+
+
+    def delete(self, user_id):
+        with self.session.begin() as session:
+            self.backend.delete(session, user_id)
+
+
+    def close(self):
+        self.engine.dispose()
+
+
+STYLES = tuple(BACKENDS)
+
+
+def timed(calls) -> dict:
+    """
+        Running the calls one after another, timing each of them
+    """
+
+    latencies = []
+    start = time.perf_counter()
+    for call, args in calls:
+        call_start = time.perf_counter()
+        call(*args)
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_query_benchmarks(path: str, iterations: int = 1000, styles=tuple(STYLES), operations=OPERATIONS, seed: int = 42, warmup: int = 20) -> list:
+    """
+        Benchmarking each operation in each style against the SQLite database at `path`
+
+        The insert phase adds `iterations` marked rows, which the update and delete phases then work on, so the table ends up as it started.
+    """
+
+    results = []
+    for style_name in styles:
+        queries = RepositoryQueries(style_name, path)
+        rng = random.Random(seed)  # Every style gets the same sequence of parameters
+        marker = f"bench-{style_name}-{int(time.time() * 1000)}"
+
+        try:
+            for _ in range(warmup):  # Fills the pools and statement caches, which would otherwise be counted in the first calls
+                queries.select(rng.randint(18, 90))
+
+            for operation in operations:
+                if operation == "select":
+                    calls = [(queries.select, (rng.randint(18, 90),)) for _ in range(iterations)]
+                elif operation == "insert":
+                    calls = [(queries.insert, (f"Bench {index}", rng.randint(18, 90), f"{marker}-{index}@example.com")) for index in range(iterations)]
+                else:
+                    ids = marked_ids(path, marker) or [rng.randint(1, 1000) for _ in range(iterations)]  # Existing rows if insert was skipped
+                    if operation == "update":
+                        calls = [(queries.update, (user_id, rng.randint(18, 90))) for user_id in ids]
+                    else:
+                        calls = [(queries.delete, (user_id,)) for user_id in ids]
+
+                results.append({"suite": "queries", "style": style_name, "operation": operation, **timed(calls)})
+        finally:
+            queries.close()
+
+    return results
+
+
+def marked_ids(path: str, marker: str) -> list:
+    with closing(sqlite3.connect(path)) as connection:
+        return [row[0] for row in connection.execute("SELECT id FROM users WHERE email LIKE ? ORDER BY id", (f"{marker}-%",))]
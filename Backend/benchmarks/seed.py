@@ -0,0 +1,64 @@
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+
+
+# The `users` table as in SQL Server, written out because the model's MSSQL types (DATETIMEOFFSET) cannot be created in SQLite
+CREATE_TABLE = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY,
+        name VARCHAR NOT NULL,
+        age INTEGER NOT NULL,
+        email VARCHAR NOT NULL UNIQUE,
+        birthday DATE NOT NULL,
+        datetime VARCHAR
+    )
+"""
+CREATE_INDEXES = [
+    "CREATE INDEX ix_users_id ON users (id)",
+    "CREATE INDEX ix_users_age_id ON users (age, id)",
+]
+
+
+def generate_users(rows: int, seed: int = 42):
+    """
+        Yielding `rows` deterministic users (the same seed gives the same data, so runs are comparable)
+    """
+
+    rng = random.Random(seed)
+    for index in range(rows):
+        age = rng.randint(18, 90)
+        birthday = date(2024, 1, 1) - timedelta(days=age * 365 + rng.randint(0, 364))
+        yield (f"User {index}", age, f"user{index}@example.com", birthday.isoformat(), "2024-10-24 14:30:00+00:00")
+
+
+def seed_database(path: str, rows: int, seed: int = 42, chunk_size: int = 50000) -> str:
+    """
+        Creating a SQLite database at `path` with `rows` users, returning its SQLAlchemy URL
+    """
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("PRAGMA journal_mode = WAL")  # Readers do not block the writer (closer to SQL Server's behaviour)
+        connection.execute(CREATE_TABLE)
+
+        users = generate_users(rows, seed)
+        while True:
+            chunk = [user for _, user in zip(range(chunk_size), users)]
+            if not chunk:
+                break
+            connection.executemany("INSERT INTO users (name, age, email, birthday, datetime) VALUES (?, ?, ?, ?, ?)", chunk)
+            connection.commit()
+
+        for statement in CREATE_INDEXES:  # Built after loading, which is faster than maintaining them row by row
+            connection.execute(statement)
+        connection.execute("ANALYZE")
+        connection.commit()
+    finally:
+        connection.close()
+
+    return f"sqlite:///{os.path.abspath(path)}"
@@ -0,0 +1,57 @@
+import sys
+from typing import List, Optional
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+try:
+    import psutil  # Optional - used for the memory figure where `resource` is not available (Windows)
+except ImportError:
+    psutil = None
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """
+        The `q` quantile (0-1) of already sorted values, by linear interpolation between the closest ranks
+    """
+
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+        Peak resident memory of this process so far (it only grows, so each result reports the peak up to that point)
+
+        None when it cannot be measured (Windows without psutil).
+    """
+
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)  # Bytes on macOS, kilobytes on Linux
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, "peak_wset", memory.rss) / (1024 * 1024), 1)  # Windows reports the peak working set
+    return None
+
+
+def summarize(latencies: List[float], elapsed: float) -> dict:
+    """
+        Throughput and latency percentiles of one benchmark (`latencies` and `elapsed` in seconds)
+    """
+
+    ordered = sorted(latencies)
+    return {
+        "iterations": len(ordered),
+        "throughput_per_s": round(len(ordered) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
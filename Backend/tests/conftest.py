@@ -0,0 +1,60 @@
+import sqlite3
+import asyncio
+import pytest
+import httpx
+from Backend.benchmarks.seed import seed_database
+from Backend.benchmarks.load import prepare_environment, create_test_app
+
+
+USERS = 3000
+CORRUPT_USER_ID = 2500  # Its birthday is not a date, so reading that row fails partway through a stream or an export
+
+
+@pytest.fixture
+def database(tmp_path) -> str:
+    """
+        A seeded SQLite database, which the app is pointed at - the services are dropped afterwards, so each test builds its own
+    """
+
+    from Backend.app.config.container import container
+
+    url = seed_database(str(tmp_path / "users.db"), USERS)
+    prepare_environment(url)
+    yield url
+    container.instances.clear()
+
+
+@pytest.fixture
+def corrupt_database(database: str) -> str:
+    connection = sqlite3.connect(database.removeprefix("sqlite:///"))
+    with connection:
+        connection.execute("UPDATE users SET birthday = 'not a date' WHERE id = ?", (CORRUPT_USER_ID,))
+    connection.close()
+    return database
+
+
+@pytest.fixture
+def send():
+    """
+        Sending a request to the app (authentication let through) and returning the response with its whole body
+    """
+
+    def send(method: str, url: str, **kwargs) -> httpx.Response:
+        from Backend.app.config.container import container
+
+        async def request():
+            transport = httpx.ASGITransport(app=create_test_app())
+            try:
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    return await client.request(method, url, **kwargs)
+            finally:
+                await container.aclose()  # In this event loop, which the pooled aiosqlite connections belong to
+
+        return asyncio.run(request())
+
+    return send
+
+
+@pytest.fixture
+def get(send):
+    return lambda url: send("GET", url)
@@ -0,0 +1,74 @@
+import time
+import asyncio
+import types
+import pytest
+from fastapi.security import SecurityScopes
+from starlette.requests import Request
+from fastapi_azure_auth import SingleTenantAzureAuthorizationCodeBearer
+from fastapi_azure_auth.exceptions import InvalidAuthHttp
+from Backend.app.config.ad_config import CachedSingleTenantAzureAuthorizationCodeBearer
+from Backend.app.utils.token_cache import TokenCache
+
+
+def request_with(token: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+
+@pytest.fixture
+def scheme(monkeypatch):
+    """
+        The cached scheme with the full verification (the parent's `__call__`) stubbed: it accepts any token and counts the calls
+    """
+
+    scheme = CachedSingleTenantAzureAuthorizationCodeBearer(
+        token_cache=TokenCache(),
+        tenant_id="00000000-0000-0000-0000-000000000000",
+        app_client_id="00000000-0000-0000-0000-000000000000",
+    )
+    scheme.verifications = 0
+
+    async def verify(self, request, security_scopes):
+        self.verifications += 1
+        return types.SimpleNamespace(claims={"scp": "User.Read Status.Read", "exp": time.time() + 3600})
+
+    async def load_config():
+        pass
+
+    monkeypatch.setattr(SingleTenantAzureAuthorizationCodeBearer, "__call__", verify)
+    monkeypatch.setattr(scheme.openid_config, "load_config", load_config)
+    scheme.openid_config.signing_keys = {"key-1": object()}
+    return scheme
+
+
+def authenticate(scheme, token: str, *scopes: str):
+    return asyncio.run(scheme(request_with(token), SecurityScopes(scopes=list(scopes))))
+
+
+def test_token_is_verified_once(scheme):
+    first = authenticate(scheme, "token-1", "User.Read")
+    second = authenticate(scheme, "token-1", "User.Read")
+    assert first is second
+    assert scheme.verifications == 1
+    authenticate(scheme, "token-2", "User.Read")
+    assert scheme.verifications == 2
+
+
+def test_cache_hit_still_checks_the_route_scopes(scheme):
+    authenticate(scheme, "token-1", "User.Read")
+    with pytest.raises(InvalidAuthHttp) as error:
+        authenticate(scheme, "token-1", "User.Delete")  # Not in the token's `scp`
+    assert error.value.status_code == 401
+    assert scheme.verifications == 1  # Rejected from the cached user
+
+
+def test_token_missing_the_scope_is_rejected_on_first_use(scheme):
+    with pytest.raises(InvalidAuthHttp):
+        authenticate(scheme, "token-1", "User.Write")
+
+
+def test_new_signing_keys_empty_the_cache(scheme):
+    authenticate(scheme, "token-1", "User.Read")
+    scheme.openid_config.signing_keys = {"key-2": object()}  # Key rotation
+    authenticate(scheme, "token-1", "User.Read")
+    assert scheme.verifications == 2
+    assert scheme.token_cache.stats()["invalidations"] == 1
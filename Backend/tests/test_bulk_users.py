@@ -0,0 +1,66 @@
+import sqlite3
+import pytest
+
+
+def user(name: str, email: str, age: int = 30, birthday: str = "1994-01-01", **fields) -> dict:
+    return {"name": name, "age": age, "email": email, "birthday": birthday, **fields}
+
+
+def rows_by_email(database: str, *emails: str) -> dict:
+    connection = sqlite3.connect(database.removeprefix("sqlite:///"))
+    try:
+        placeholders = ", ".join("?" * len(emails))
+        return {email: (name, age) for email, name, age in connection.execute(f"SELECT email, name, age FROM users WHERE email IN ({placeholders})", emails)}
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def rejecting_database(database: str) -> str:
+    # Stands in for a constraint only the database checks: inserting a user named "reject" fails
+    connection = sqlite3.connect(database.removeprefix("sqlite:///"))
+    with connection:
+        connection.execute("CREATE TRIGGER reject_user BEFORE INSERT ON users WHEN NEW.name = 'reject' BEGIN SELECT RAISE(ABORT, 'user rejected'); END")
+    connection.close()
+    return database
+
+
+BODY = [
+    user("New", "new@example.com"),
+    {"name": "Incomplete", "email": "incomplete@example.com"},  # No age and birthday
+    user("First", "dup@example.com"),
+    user("Second", "dup@example.com"),  # Same email later in the chunk - this one is written
+    user("Updated", "user0@example.com", age=99),  # An existing user (seeded)
+]
+
+
+def test_bulk_upsert_reports_bad_records_and_writes_the_rest(database, send):
+    response = send("POST", "/api/users/bulk", json=BODY)
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["updated"]) == (2, 1)
+    failed = {error["index"]: error for error in result["failed"]}
+    assert set(failed) == {1, 2}
+    assert failed[1]["error"] == "Missing required fields: age, birthday"
+    assert failed[2]["error"] == "Duplicate email, superseded by record 3"
+
+    assert rows_by_email(database, "new@example.com", "dup@example.com", "user0@example.com", "incomplete@example.com") == {
+        "new@example.com": ("New", 30),
+        "dup@example.com": ("Second", 30),
+        "user0@example.com": ("Updated", 99),
+    }
+
+
+def test_bulk_upsert_isolates_a_record_the_database_rejects(rejecting_database, send):
+    # The chunk fails as a whole, so its records are retried one by one and only the rejected one is reported
+    response = send("POST", "/api/users/bulk", json=[*BODY, user("reject", "rejected@example.com")])
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["updated"]) == (2, 1)
+    failed = {error["index"]: error for error in result["failed"]}
+    assert set(failed) == {1, 2, 5}
+    assert "user rejected" in failed[5]["error"]
+
+    rows = rows_by_email(rejecting_database, "new@example.com", "dup@example.com", "user0@example.com", "rejected@example.com")
+    assert set(rows) == {"new@example.com", "dup@example.com", "user0@example.com"}
+    assert rows["user0@example.com"] == ("Updated", 99)
@@ -0,0 +1,10 @@
+import logging
+from Backend.app.config.db_config import TimedQueuePool, TimedAsyncAdaptedQueuePool
+
+
+def test_timed_pools_log_under_sqlalchemy():
+    # Under the "sqlalchemy" logger (WARNING), not this app's, which may be at DEBUG and would log every checkout
+    for pool_class in (TimedQueuePool, TimedAsyncAdaptedQueuePool):
+        pool = pool_class(lambda: None)
+        assert pool.logger.name.startswith("sqlalchemy.pool.")
+        assert not pool.logger.isEnabledFor(logging.INFO)
@@ -0,0 +1,123 @@
+import shutil
+import sqlite3
+import pytest
+from sqlalchemy import create_engine, select, update
+from Backend.app.models.user import UserDataModel
+from Backend.app.config.db_routing import ReadYourWrites, Replica, ReplicaSet, request_pin
+
+
+def path_of(url: str) -> str:
+    return url.removeprefix("sqlite:///")
+
+
+def name_of_user_1(url: str) -> str:
+    connection = sqlite3.connect(path_of(url))
+    try:
+        return connection.execute("SELECT name FROM users WHERE id = 1").fetchone()[0]
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def replicas(database, tmp_path, monkeypatch) -> list:
+    """
+        Two copies of the database as read replicas, each with its own name for user 1 - so a read tells where it was served from
+    """
+
+    urls = []
+    for name in ("replica1", "replica2"):
+        path = tmp_path / f"{name}.db"
+        shutil.copyfile(path_of(database), path)
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute("UPDATE users SET name = ? WHERE id = 1", (name,))
+        connection.close()
+        urls.append(f"sqlite:///{path}")
+
+    monkeypatch.setenv("DB_REPLICA_URLS", ",".join(urls))
+    monkeypatch.setenv("DB_REPLICA_CHECK_INTERVAL", "0")  # No health thread - the tests ping explicitly
+    return urls
+
+
+@pytest.fixture
+def new_session(replicas):
+    from Backend.app.config import db_config
+
+    sessions = []
+
+    def new_session():
+        sessions.append(db_config.db_session())
+        return sessions[-1]
+
+    yield new_session
+    for session in sessions:
+        session.close()
+
+
+READ_USER_1 = select(UserDataModel.name).where(UserDataModel.id == 1)
+
+
+def test_reads_go_to_the_replicas_in_turn(new_session):
+    served_by = [new_session().scalar(READ_USER_1) for _ in range(4)]
+    assert served_by == ["replica1", "replica2", "replica1", "replica2"]
+
+
+def test_session_stays_on_its_replica(new_session):
+    session = new_session()
+    assert len({session.scalar(READ_USER_1) for _ in range(3)}) == 1  # Not alternating between the replicas
+
+
+def test_writes_go_to_the_primary(database, replicas, new_session):
+    session = new_session()
+    session.execute(update(UserDataModel).where(UserDataModel.id == 1).values(name="written"))
+    assert session.scalar(READ_USER_1) == "written"  # The session reads from the primary once it has written
+    session.commit()
+
+    assert name_of_user_1(database) == "written"
+    assert [name_of_user_1(url) for url in replicas] == ["replica1", "replica2"]
+
+
+def test_patch_is_written_to_the_primary(database, replicas, send):
+    response = send("PATCH", "/api/users/1", json={"name": "patched"})
+    assert response.status_code == 200
+    assert name_of_user_1(database) == "patched"
+    assert [name_of_user_1(url) for url in replicas] == ["replica1", "replica2"]
+
+
+def test_read_your_writes_pins_the_rest_of_the_request(new_session):
+    token = request_pin.set(ReadYourWrites())
+    try:
+        assert new_session().scalar(READ_USER_1).startswith("replica")  # Nothing written yet
+
+        writer = new_session()
+        writer.execute(update(UserDataModel).where(UserDataModel.id == 1).values(name="written"))
+        writer.commit()
+
+        # A new session of the same request reads its write, from the primary
+        assert new_session().scalar(READ_USER_1) == "written"
+    finally:
+        request_pin.reset(token)
+
+    # Other requests still read from the replicas
+    assert new_session().scalar(READ_USER_1).startswith("replica")
+
+
+def test_failing_replica_is_taken_out_of_rotation(tmp_path):
+    healthy = Replica("healthy", create_engine(f"sqlite:///{tmp_path / 'healthy.db'}"))
+    missing = tmp_path / "missing"
+    failing = Replica("failing", create_engine(f"sqlite:///{missing / 'replica.db'}"))  # Its directory does not exist, so it cannot be opened
+    replica_set = ReplicaSet([healthy, failing], max_failures=2, check_interval=0)
+
+    replica_set.check()
+    assert failing.healthy and failing.failures == 1  # One failed ping is not enough
+    replica_set.check()
+    assert not failing.healthy
+    assert {replica_set.choose() for _ in range(4)} == {healthy}
+
+    missing.mkdir()
+    replica_set.check()
+    assert failing.healthy and failing.failures == 0  # Put back once a ping succeeds
+    assert {replica_set.choose() for _ in range(4)} == {healthy, failing}
+
+    healthy.healthy = failing.healthy = False
+    assert replica_set.choose() is None  # Reads go to the primary
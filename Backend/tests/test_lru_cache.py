@@ -0,0 +1,41 @@
+from Backend.app.utils.lru_cache import LRUCache
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_size=2, clock=Clock())
+    cache.put("a", 1, expires_at=100)
+    cache.put("b", 2, expires_at=100)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3, expires_at=100)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entry_expires():
+    clock = Clock()
+    cache = LRUCache(max_size=10, clock=clock)
+    cache.put("a", 1, expires_at=10)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"]) == (0, 1, 1)  # The expired entry is removed when it is found
+
+
+def test_put_replaces_and_refreshes_an_entry():
+    cache = LRUCache(max_size=2, clock=Clock())
+    cache.put("a", 1, expires_at=100)
+    cache.put("b", 2, expires_at=100)
+    cache.put("a", 10, expires_at=100)
+    cache.put("c", 3, expires_at=100)
+    assert (cache.get("a"), cache.get("b")) == (10, None)
@@ -0,0 +1,29 @@
+import json
+import base64
+import pytest
+from Backend.app.utils.pagination import encode_cursor, decode_cursor
+
+
+def make_token(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def test_round_trip():
+    cursor = encode_cursor(30, 12345)
+    assert "=" not in cursor  # Padding stripped, so it needs no escaping in a URL
+    assert decode_cursor(cursor, int, int) == (30, 12345)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 !",
+    base64.urlsafe_b64encode(b"{not json").decode(),
+    make_token({"age": 30, "id": 1}),  # Not a list
+    make_token([30]),  # Too few values
+    make_token([30, 1, 2]),  # Too many values
+    make_token(["30", 1]),  # A string instead of a number
+    make_token([True, 1]),  # A boolean, which is an int in Python
+    make_token([30.5, 1]),
+])
+def test_tampered_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, int, int)
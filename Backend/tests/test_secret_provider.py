@@ -0,0 +1,54 @@
+import time
+from Backend.app.utils.get_credentials import SecretBackend, SecretProvider
+
+
+class CountingBackend(SecretBackend):
+    name = "counting"
+
+    def __init__(self):
+        self.values = {"DB-PASSWORD": "first"}
+        self.calls = 0
+        self.error = None
+
+    def get(self, key: str):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.values[key]
+
+
+def wait_for(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_rotated_secret_is_refreshed_before_it_expires():
+    backend = CountingBackend()
+    provider = SecretProvider(backend, ttl=0.4, refresh_margin=0.3)
+    try:
+        assert provider.get("DB-PASSWORD") == "first"
+        backend.values["DB-PASSWORD"] = "rotated"
+        # Fetched again by the background thread, so the reader gets the new value without waiting for the backend
+        assert wait_for(lambda: backend.calls >= 2)
+        calls = backend.calls
+        assert provider.get("DB-PASSWORD") == "rotated"
+        assert backend.calls == calls
+    finally:
+        provider.stop_refresh()
+
+
+def test_failed_refresh_keeps_the_value_and_backs_off():
+    backend = CountingBackend()
+    provider = SecretProvider(backend, ttl=0.4, refresh_margin=0.3, retry_delay=0.2)
+    try:
+        provider.get("DB-PASSWORD")
+        backend.error = ConnectionError("vault unreachable")
+        assert wait_for(lambda: provider.failures.get("DB-PASSWORD") == 1)
+        assert provider.get("DB-PASSWORD") == "first"  # Kept, rather than replaced by the (missing) environment variable
+        time.sleep(0.1)
+        assert backend.calls == 2  # The next try waits for `retry_delay`, not for the refresh loop's next turn
+        assert wait_for(lambda: backend.calls >= 3)
+    finally:
+        provider.stop_refresh()
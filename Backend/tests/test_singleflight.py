@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from Backend.app.utils.singleflight import SingleFlight
+
+
+class Call():
+    """
+        A call which waits until `release` is set, counting how often it was made
+    """
+
+    def __init__(self, result="rows", error: Exception = None):
+        self.result = result
+        self.error = error
+        self.count = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.count += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def started(*tasks):
+    await asyncio.sleep(0)  # Let the tasks reach their first `await`
+    return tasks
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        flight, call = SingleFlight(), Call()
+        tasks = await started(*(asyncio.create_task(flight.do("key", call)) for _ in range(5)))
+        call.release.set()
+        return await asyncio.gather(*tasks), call.count, flight.stats()
+
+    results, count, stats = asyncio.run(main())
+    assert results == ["rows"] * 5
+    assert count == 1
+    assert (stats["calls"], stats["joined"], stats["in_flight"]) == (1, 4, 0)
+
+
+def test_error_reaches_every_caller():
+    async def main():
+        flight, call = SingleFlight(), Call(error=RuntimeError("query failed"))
+        tasks = await started(*(asyncio.create_task(flight.do("key", call)) for _ in range(3)))
+        call.release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True), flight.stats()
+
+    results, stats = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert (stats["errors"], stats["in_flight"]) == (1, 0)
+
+
+def test_cancelled_leader_does_not_cancel_the_call_for_the_followers():
+    async def main():
+        flight, call = SingleFlight(), Call()
+        leader, follower = await started(asyncio.create_task(flight.do("key", call)), asyncio.create_task(flight.do("key", call)))
+        leader.cancel()
+        await asyncio.sleep(0)
+        call.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, call.count
+
+    assert asyncio.run(main()) == ("rows", 1)
+
+
+def test_cancelled_follower_does_not_cancel_the_call():
+    async def main():
+        flight, call = SingleFlight(), Call()
+        leader, follower = await started(asyncio.create_task(flight.do("key", call)), asyncio.create_task(flight.do("key", call)))
+        follower.cancel()
+        await asyncio.sleep(0)
+        call.release.set()
+        return await leader
+
+    assert asyncio.run(main()) == "rows"
+
+
+def test_follower_gives_up_after_the_timeout():
+    async def main():
+        flight = SingleFlight(timeout=0.01)
+        slow, fast = Call("slow"), Call("fast")
+        fast.release.set()
+        leader, = await started(asyncio.create_task(flight.do("key", slow)))
+        result = await flight.do("key", fast)  # Joins the slow call, then makes its own
+        slow.release.set()
+        await leader
+        return result, flight.stats()["timeouts"]
+
+    assert asyncio.run(main()) == ("fast", 1)
+
+
+def test_no_joining_a_call_older_than_the_window():
+    async def main():
+        flight, call = SingleFlight(window=0), Call()
+        first, = await started(asyncio.create_task(flight.do("key", call)))
+        await asyncio.sleep(0.01)
+        second, = await started(asyncio.create_task(flight.do("key", call)))
+        call.release.set()
+        await asyncio.gather(first, second)
+        return call.count
+
+    assert asyncio.run(main()) == 2
+
+
+def test_disabled_makes_every_call():
+    async def main():
+        flight, call = SingleFlight(enabled=False), Call()
+        tasks = await started(*(asyncio.create_task(flight.do("key", call)) for _ in range(3)))
+        call.release.set()
+        await asyncio.gather(*tasks)
+        return call.count
+
+    assert asyncio.run(main()) == 3
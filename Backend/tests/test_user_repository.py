@@ -0,0 +1,21 @@
+import pytest
+from sqlalchemy import text
+from Backend.app.repositories.user import BACKENDS, user_repository
+
+
+@pytest.fixture
+def session(database):
+    from Backend.app.config import db_config
+
+    session = db_config.db_session()  # The session factory, built for the fixture's database
+    yield session
+    session.close()
+
+
+def test_backends_return_the_same_names(session):
+    expected = sorted(name for (name,) in session.execute(text("SELECT name FROM users WHERE age > 80")))
+    assert expected
+    for name in BACKENDS:
+        names = user_repository.backend(name).names_older_than(session, 80)
+        assert sorted(names) == expected, name
+        assert all(isinstance(value, str) for value in names), name  # Names, not model instances or rows
@@ -0,0 +1,39 @@
+import json
+import pytest
+from Backend.tests.conftest import USERS
+
+
+def test_export_csv(database, get):
+    response = get("/api/users/export?format=csv&batch_size=100")
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines[0] == "id,name,age,email,birthday,datetime"
+    assert len(lines) == USERS + 1
+
+
+def test_export_rejects_unknown_format(database, get):
+    response = get("/api/users/export?format=xml")
+    assert response.status_code == 400
+    assert "Unsupported format 'xml'" in response.json()["detail"]
+
+
+def test_export_error_aborts_the_response(corrupt_database, get):
+    # The rows before the bad one have already been sent with a 200, so the transfer must break rather than end as a complete-looking file
+    # (Starlette raises the error of the body's task in an exception group)
+    with pytest.raises(ExceptionGroup) as error:
+        get("/api/users/export?format=csv&batch_size=100")
+    assert error.group_contains(ValueError, match="not a date")
+
+
+def test_stream(database, get):
+    response = get("/api/users/stream?user_age=0&batch_size=100")
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert len(lines) == USERS
+    assert set(json.loads(lines[0])) == {"id", "name", "age", "email", "birthday", "datetime"}
+
+
+def test_stream_error_aborts_the_response(corrupt_database, get):
+    with pytest.raises(ExceptionGroup) as error:
+        get("/api/users/stream?user_age=0&batch_size=100")
+    assert error.group_contains(ValueError, match="not a date")
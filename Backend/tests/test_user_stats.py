@@ -0,0 +1,43 @@
+from Backend.app.utils.user_stats import AgeHistogram, UserStats
+
+
+def test_single_worker_snapshot_has_no_lag():
+    stats = UserStats(reconcile_interval=300, workers=1)
+    stats.reconcile([(30, 2), (40, 1)])
+    snapshot = stats.snapshot()
+    assert snapshot["total"] == 3
+    assert "max_lag_seconds" not in snapshot
+    assert snapshot["stale"] is False
+
+
+def test_several_workers_snapshot_reports_the_lag():
+    stats = UserStats(reconcile_interval=30, workers=4)
+    stats.reconcile([(30, 2)])
+    assert stats.snapshot()["max_lag_seconds"] == 30
+
+    # Without periodic recounts the other workers' writes may never show up
+    stats = UserStats(reconcile_interval=0, workers=4)
+    stats.reconcile([(30, 2)])
+    snapshot = stats.snapshot()
+    assert snapshot["max_lag_seconds"] is None
+    assert snapshot["stale"] is True
+
+
+def test_percentile_nearest_rank():
+    histogram = AgeHistogram({20: 1, 30: 1, 40: 1, 50: 1})
+    assert histogram.percentile(0) == 20
+    assert histogram.percentile(25) == 20  # Exactly 1 of the 4 users
+    assert histogram.percentile(26) == 30
+    assert histogram.percentile(50) == 30
+    assert histogram.percentile(100) == 50
+    assert AgeHistogram().percentile(50) is None
+
+
+def test_histogram_add_and_remove():
+    histogram = AgeHistogram({30: 2, 40: 1})
+    histogram.add(30, -2)
+    histogram.add(50)
+    histogram.add(None)  # Unknown ages are ignored
+    assert histogram.counts == {40: 1, 50: 1}
+    assert histogram.count_older_than(40) == 1
+    assert histogram.summary() == {"total": 2, "min": 40, "max": 50, "mean": 45.0}
@@ -0,0 +1,159 @@
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+from Backend.app.utils import write_behind
+from Backend.app.utils.write_behind import UserWriteBehind
+
+
+class FakeDatabase():
+    """
+        Stands in for `open_session` + `write_batch`: records the committed batches, and fails the ones `fail` says so
+    """
+
+    def __init__(self):
+        self.committed = []
+        self.attempts = 0
+        self.fail = lambda batch: None  # batch -> the exception to raise, or None
+
+    @asynccontextmanager
+    async def open_session(self):
+        database = self
+
+        class Session():
+            async def run_sync(self, fn, batch):
+                database.attempts += 1
+                error = database.fail(batch)
+                if error is not None:
+                    raise error
+                self.batch = batch
+                return len(batch)
+
+            async def commit(self):
+                database.committed.append(self.batch)
+
+        yield Session()
+
+
+@pytest.fixture
+def database(monkeypatch) -> FakeDatabase:
+    database = FakeDatabase()
+    monkeypatch.setattr(write_behind, "open_session", database.open_session)
+    return database
+
+
+def connection_lost() -> OperationalError:
+    return OperationalError("UPDATE users ...", {}, Exception("Communication link failure"))
+
+
+def duplicate_email() -> IntegrityError:
+    return IntegrityError("UPDATE users ...", {}, Exception("UNIQUE constraint failed: users.email"))
+
+
+def run(scenario):
+    async def main():
+        queue = UserWriteBehind(enabled=True, flush_interval=60, retry_delay=0.01)
+        queue.start()
+        try:
+            return await scenario(queue)
+        finally:
+            queue.task.cancel()
+    return asyncio.run(main())
+
+
+def test_transient_failure_keeps_the_changes(database):
+    async def scenario(queue):
+        await queue.submit(1, {"name": "a"})
+        await queue.submit(2, None)
+        database.fail = lambda batch: connection_lost()
+        with pytest.raises(OperationalError):
+            await queue.flush()
+        assert database.attempts == 1  # Not retried user by user while the database is unreachable
+        assert queue.failed == 0
+        assert {user_id: [fields for _, fields in submissions] for user_id, submissions in queue.pending.items()} == {1: [{"name": "a"}], 2: [None]}
+
+        await queue.submit(1, {"email": "a@example.com"})  # Submitted during the outage - applied after the requeued change
+        database.fail = lambda batch: None
+        await queue.flush()
+        return database.committed
+
+    assert run(scenario) == [{1: {"name": "a", "email": "a@example.com"}, 2: None}]
+
+
+def test_transient_failure_while_retrying_user_by_user(database):
+    async def scenario(queue):
+        await queue.submit(1, {"email": "taken@example.com"})
+        await queue.submit(2, {"name": "b"})
+        # The batch is rejected for user 1's data, then the database goes away before user 2 is written
+        database.fail = lambda batch: duplicate_email() if 1 in batch else connection_lost()
+        with pytest.raises(OperationalError):
+            await queue.flush()
+        assert queue.failed == 1
+        assert list(queue.pending) == [2]
+
+        database.fail = lambda batch: None
+        await queue.flush()
+        return database.committed
+
+    assert run(scenario) == [{2: {"name": "b"}}]
+
+
+def test_requeued_delete_wins_over_later_updates(database):
+    async def scenario(queue):
+        await queue.submit(1, None)
+        database.fail = lambda batch: connection_lost()
+        with pytest.raises(OperationalError):
+            await queue.flush()
+        await queue.submit(1, {"name": "a"})
+        database.fail = lambda batch: None
+        await queue.flush()
+        return database.committed
+
+    assert run(scenario) == [{1: None}]
+
+
+def test_background_flush_backs_off_and_retries(database):
+    async def scenario(queue):
+        failures = iter([connection_lost(), connection_lost()])
+        database.fail = lambda batch: next(failures, None)
+        queue.flush_interval = 0.01
+        await queue.submit(1, {"name": "a"})
+        for _ in range(200):
+            if database.committed:
+                break
+            await asyncio.sleep(0.01)
+        return database.committed, queue.retries, queue.failures_in_a_row
+
+    assert run(scenario) == ([{1: {"name": "a"}}], 2, 0)
+
+
+def test_merge():
+    assert write_behind.merge([(1, {"name": "a", "age": 30}), (2, {"age": 31})]) == {"name": "a", "age": 31}
+    assert write_behind.merge([(1, None)]) is None
+
+
+def test_submissions_are_merged_per_user(database):
+    async def scenario(queue):
+        await queue.submit(1, {"name": "a", "email": None})  # None: left unchanged
+        await queue.submit(1, {"age": 30})
+        await queue.submit(2, {"name": "b"})
+        await queue.submit(2, None)  # Replaces the update before it
+        await queue.submit(2, {"name": "c"})  # Dropped, the user is about to be deleted
+        await queue.flush()
+        return database.committed
+
+    assert run(scenario) == [{1: {"name": "a", "age": 30}, 2: None}]
+
+
+def test_bad_submission_only_drops_itself(database):
+    async def scenario(queue):
+        await queue.submit(1, {"email": "taken@example.com"})
+        await queue.submit(1, {"name": "a"})
+        await queue.submit(2, {"name": "b"})
+        database.fail = lambda batch: duplicate_email() if "email" in (batch.get(1) or {}) else None
+        await queue.flush()
+        return database.committed, queue.failed
+
+    committed, failed = run(scenario)
+    assert committed == [{1: {"name": "a"}}, {2: {"name": "b"}}]
+    assert failed == 1